@@ -20,13 +20,16 @@ import warnings
 import wx.lib.mixins.listctrl as listmix
 
 from openstv.STV import *
-from openstv.ballots import Ballots
+from openstv.ballots import Ballots, IndexedBallots
 from openstv.utils import getHome
 
 ##################################################################
 
 class BFEFrame(wx.Frame):
 
+  # BLT files at least this large are read lazily instead of loaded
+  indexSize = 32 * 2**20
+
   def __init__(self, parent, mode):
     wx.Frame.__init__(self, parent, -1, "Ballot File Editor")
 
@@ -68,8 +71,13 @@ class BFEFrame(wx.Frame):
 
       # Open the file
       try:
-        self.b = Ballots()
-        self.b.loadUnknown(fName)
+        if (os.path.getsize(fName) >= self.indexSize and
+            IndexedBallots.canIndex(fName)):
+          self.b = IndexedBallots()
+          self.b.loadIndexed(fName)
+        else:
+          self.b = Ballots()
+          self.b.loadUnknown(fName)
       except RuntimeError, msg:
         wx.MessageBox(str(msg), "Error", wx.OK|wx.ICON_ERROR)
         self.Destroy()
@@ -169,7 +177,10 @@ class BFEFrame(wx.Frame):
     try:
       oldNumBallots = self.b.numBallots
       self.b.appendFile(fName)
-      self.b = self.b.getCleanBallots(removeEmpty=False, removeWithdrawn=False)
+      if not isinstance(self.b, IndexedBallots):
+        # Indexed ballots are not all in memory to be merged
+        self.b = self.b.getCleanBallots(removeEmpty=False,
+                                        removeWithdrawn=False)
     except RuntimeError, msg:
       wx.MessageBox(str(msg), "Error", wx.OK|wx.ICON_ERROR)
     else:
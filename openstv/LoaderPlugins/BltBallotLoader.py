@@ -14,8 +14,14 @@
 
 __revision__ = "$Id: BltBallotLoader.py 719 2010-03-01 03:43:54Z jeff.oneill $"
 
+import os
 import re
-from openstv.plugins import LoaderPlugin
+import multiprocessing
+from bisect import bisect_right
+from itertools import chain, tee
+from array import array
+from openstv.plugins import LoaderPlugin, getCompression
+from openstv.ballots import ListBallotStore
 
 class BltBallotLoader(LoaderPlugin):
   "Ballot loader class for ballots defined by ERS."
@@ -32,38 +38,206 @@ class BltBallotLoader(LoaderPlugin):
   endOfBallotsRE = re.compile(r'\s*0\s*(?:#.*)?')
   stringRE = re.compile(r'^\s*"([^"]+)"\s*(?:#.*)?$')
 
+  # Files at least this large are parsed in parallel, in chunks of about
+  # chunkSize bytes, by a pool of this many processes (None for one process
+  # per CPU).
+  parallelSize = 64 * 2**20
+  chunkSize = 16 * 2**20
+  processes = None
+
   def __init__(self):
     LoaderPlugin.__init__(self)
 
+  def load(self, ballotList, fName):
+    "Load a file from a filename, in parallel if it is large."
+
+    processes = self.processes
+    if processes is None:
+      processes = multiprocessing.cpu_count()
+    if multiprocessing.current_process().daemon:
+      processes = 1
+    if (processes > 1 and hasattr(os, "fork") and fName != "-" and
+        os.path.getsize(fName) >= self.parallelSize and
+        getCompression(fName) is None):
+      self.fName = fName
+      f = open(self.fName, "r")
+      try:
+        self.loadInParallel(ballotList, f, processes)
+      finally:
+        f.close()
+    else:
+      LoaderPlugin.load(self, ballotList, fName)
+
   def loadFromObject(self, ballotList, f):
     "Load ERS ballot data from a file-like object."
     
-    if self.hasCustomBallotIDs(f):
+    (customBallotIDs, f) = self.hasCustomBallotIDs(f)
+    if customBallotIDs:
       ballotList.customBallotIDs = True
     
-    line = self.getNextNonBlankLine(f)
+    line = self.loadHeader(ballotList, f)
+    numCandidates = ballotList.numCandidates
+
+    try:
+      if ballotList.customBallotIDs:
+        while not self.atEndOfBallots(line):
+          (customID, ballot) = self.getBallotWithCustomID(line)
+          ballotList.appendBallot(ballot, customID)
+          line = self.getNextNonBlankLine(f)
+      else:
+        ballotList.appendBallots(self.readBallots(line, f, numCandidates))
+
+      self.loadNamesAndTitle(ballotList, f)
+    except StopIteration:
+      self.reportLoadError("The file ends before the names and the title.")
+
+  def loadInParallel(self, ballotList, f, processes):
+    "Load ERS ballot data from a file with a pool of processes."
+
+    customBallotIDs = self.hasCustomBallotIDs(f)[0]
+    f.seek(0)
+    if customBallotIDs:
+      # Not worth it since each ballot is unique
+      self.loadFromObject(ballotList, f)
+      return
+
+    # Read the header a line at a time so that we know where the ballot
+    # section starts.
+    lines = iter(f.readline, "")
+    line = self.loadHeader(ballotList, lines)
+    start = f.tell() - len(line)
+    size = os.fstat(f.fileno()).st_size
+
+    # Chunks end at the start of a line
+    boundaries = [start]
+    position = start + self.chunkSize
+    while position < size:
+      f.seek(position)
+      f.readline()
+      position = f.tell()
+      if position >= size:
+        break
+      boundaries.append(position)
+      position += self.chunkSize
+    boundaries.append(size)
+    chunks = [(self.fName, boundaries[i], boundaries[i+1],
+               ballotList.numCandidates) for i in range(len(boundaries) - 1)]
+
+    # Chunks after the end of the ballot section hold the names and are not
+    # used.  Errors in those chunks are therefore ignored.
+    end = size
+    pool = multiprocessing.Pool(processes)
+    try:
+      for (error, ballots, counts, order, chunkEnd) in \
+            pool.imap(parseBallotChunk, chunks):
+        if error is not None:
+          raise RuntimeError(error)
+        ballotList.appendUniqueBallots(ballots, counts, order)
+        if chunkEnd is not None:
+          end = chunkEnd
+          break
+    finally:
+      pool.terminate()
+
+    f.seek(end)
+    self.loadNamesAndTitle(ballotList, iter(f.readline, ""))
+
+  def sniff(self, head):
+    "Check that the first lines are ERS ballot data."
+
+    lines = iter(self.getCompleteLines(head))
+    try:
+      line = self.getNextNonBlankLine(lines)
+      (numCandidates, numSeats) = self.getNumCandidatesAndSeats(line)
+      line = self.getNextNonBlankLine(lines)
+      if self.withdrawnRE.match(line) is not None:
+        line = self.getNextNonBlankLine(lines)
+      customBallotIDs = self.ballotAndIDRE.match(line) is not None
+      while not self.atEndOfBallots(line):
+        if customBallotIDs:
+          self.getBallotWithCustomID(line)
+        else:
+          self.getBallot(line)
+        line = self.getNextNonBlankLine(lines)
+      # The names and the title
+      for i in range(numCandidates + 1):
+        self.getCandidateName(self.getNextNonBlankLine(lines))
+    except StopIteration:
+      # The head ends before the file does
+      pass
+    return 50
+
+  def loadIndex(self, ballotList, fName):
+    "Load a BLT file without its ballots and return a BltBallotIndex."
+
+    self.fName = fName
+    f = open(self.fName, "rb")
+    try:
+      customBallotIDs = self.hasCustomBallotIDs(f)[0]
+      f.seek(0)
+      line = self.loadHeader(ballotList, iter(f.readline, ""))
+      position = f.tell() - len(line)
+      ballotList.customBallotIDs = customBallotIDs
+
+      linesPerOffset = BltBallotIndex.linesPerOffset
+      offsets = array("l")
+      firstBallots = array("l")
+      numLines = 0
+      numBallots = 0
+      for line in chain([line], f):
+        weight = self.getLineWeight(line, customBallotIDs)
+        if weight is None:
+          position += len(line)
+          continue
+        elif weight < 0:
+          position += len(line)
+          break
+        elif weight > 0:
+          if numLines % linesPerOffset == 0:
+            offsets.append(position)
+            firstBallots.append(numBallots)
+          numLines += 1
+          numBallots += weight
+        position += len(line)
+      else:
+        self.reportLoadError("The end of the ballots is missing.")
+
+      f.seek(position)
+      self.loadNamesAndTitle(ballotList, iter(f.readline, ""))
+    finally:
+      f.close()
+
+    return BltBallotIndex(self, offsets, firstBallots, numBallots,
+                          customBallotIDs)
+
+  def loadHeader(self, ballotList, f):
+    "Read the numbers of candidates and seats and the withdrawn candidates."
+
+    try:
+      line = self.getNextNonBlankLine(f)
+    except StopIteration:
+      self.reportLoadError("There is no ballot data.")
     (numCandidates, numSeats) = self.getNumCandidatesAndSeats(line)
     ballotList.numCandidates = numCandidates
     ballotList.numSeats = numSeats
 
-    line = self.getNextNonBlankLine(f)
-    withdrawn = self.getWithdrawnCandidates(line)
-    if withdrawn != []:
-      ballotList.withdrawn = withdrawn
+    try:
       line = self.getNextNonBlankLine(f)
+      withdrawn = self.getWithdrawnCandidates(line)
+      if withdrawn != []:
+        ballotList.withdrawn = withdrawn
+        line = self.getNextNonBlankLine(f)
+    except StopIteration:
+      self.reportLoadError("The file ends before the ballots.")
 
-    while not self.atEndOfBallots(line):
-      
-      if ballotList.customBallotIDs:
-        (customID, ballot) = self.getBallotWithCustomID(line)
-        ballotList.appendBallot(ballot, customID)
-      else:
-        (weight, ballot) = self.getBallot(line)
-        for i in xrange(weight):
-          ballotList.appendBallot(ballot)
-      line = self.getNextNonBlankLine(f)
+    # The first line of the ballot section
+    return line
+
+  def loadNamesAndTitle(self, ballotList, f):
+    "Read the candidate names and the title after the ballot section."
 
     names = []
+    numCandidates = ballotList.numCandidates
     for c in range(numCandidates):
       line = self.getNextNonBlankLine(f)
       name = self.getCandidateName(line)
@@ -73,15 +247,82 @@ class BltBallotLoader(LoaderPlugin):
     line = self.getNextNonBlankLine(f)
     ballotList.title = self.getTitle(line)
     
+  def readBallots(self, line, f, numCandidates):
+    "Generate (weight, ballot) pairs from the ballot section."
+
+    # Candidate number strings and the candidate index for each one
+    candidates = dict((str(c + 1), c) for c in range(numCandidates))
+    candidates["0"] = -1
+    candidate = candidates.__getitem__
+
+    self.foundEndOfBallots = False
+    for line in chain([line], f):
+      fields = line.split()
+      if fields and fields[-1] == "0" and fields[0].isdigit():
+        if fields[0][0] == "0":
+          self.foundEndOfBallots = True
+          return
+        try:
+          ballot = map(candidate, fields[1:-1])
+        except KeyError:
+          yield self.getBallot(line)
+        else:
+          yield (int(fields[0]), ballot)
+      elif self.blankLineRE.match(line) is not None:
+        continue
+      elif self.atEndOfBallots(line):
+        self.foundEndOfBallots = True
+        return
+      else:
+        yield self.getBallot(line)
+
+  def getLineWeight(self, line, customBallotIDs):
+    "Return the weight of a ballot line, None if blank, or -1 at the end."
+
+    if customBallotIDs:
+      stripped = line.strip()
+      if stripped[:1] == "(":
+        rest = stripped[stripped.find(")") + 1:]
+        if rest.split(None, 1)[:1] == ["1"] and rest.endswith(" 0"):
+          return 1
+      if self.blankLineRE.match(line) is not None:
+        return None
+      if self.atEndOfBallots(line):
+        return -1
+      self.getBallotWithCustomID(line)
+      return 1
+
+    if line[:2] == "1 " and line.rstrip().endswith(" 0"):
+      # The usual line
+      return 1
+    # Only the first and last fields are needed
+    fields = line.split(None, 1)
+    if (fields and fields[0].isdigit() and
+        line.rsplit(None, 1)[-1] == "0"):
+      if fields[0][0] == "0":
+        return -1
+      return int(fields[0])
+    if self.blankLineRE.match(line) is not None:
+      return None
+    if self.atEndOfBallots(line):
+      return -1
+    return self.getBallot(line)[0]
+
   def hasCustomBallotIDs(self, f):
-    self.getNextNonBlankLine(f) # candidates and seats
-    self.getNextNonBlankLine(f) # maybe withdrawn candidates
-    line = self.getNextNonBlankLine(f) # ballot
-    f.seek(0)
+    "Return whether the ballots have custom IDs and the lines of f."
+    (f, head) = tee(f)
+    try:
+      self.getNextNonBlankLine(head) # candidates and seats
+      self.getNextNonBlankLine(head) # maybe withdrawn candidates
+      line = self.getNextNonBlankLine(head) # ballot
+    except StopIteration:
+      # loadHeader() reports a file that ends this soon
+      return (False, f)
+    del head
     if self.ballotAndIDRE.match(line) is None:
-      return False
+      return (False, f)
     else:
-      return True
+      return (True, f)
     
   def getNumCandidatesAndSeats(self, line):
     out = self.nCandnSeatsRE.match(line)
@@ -185,7 +426,7 @@ class BltBallotLoader(LoaderPlugin):
     
     if fName is not None:
       self.fName = self.normalizeFileName(fName)
-    f = open(self.fName, "w")
+    f = self.createFile()
 
     f.write("%d %d\n" % (ballotList.numCandidates, ballotList.numSeats))
     
@@ -215,3 +456,97 @@ class BltBallotLoader(LoaderPlugin):
     f.write('"%s"\n' % ballotList.title)
 
     f.close()
+
+##################################################################
+
+class BltBallotIndex(object):
+  "Offsets of every linesPerOffset-th ballot line of a BLT file."
+
+  linesPerOffset = 64
+
+  def __init__(self, loader, offsets, firstBallots, numBallots,
+               customBallotIDs):
+    self.loader = loader
+    self.offsets = offsets
+    self.firstBallots = firstBallots
+    self.numBallots = numBallots
+    self.customBallotIDs = customBallotIDs
+    self.f = None
+    self.nextBallot = None # The first ballot of the next line in f
+    self.current = None # (first ballot, weight, ballot, ID) of the last line
+
+  def close(self):
+    if self.f is not None:
+      self.f.close()
+      self.f = None
+      self.nextBallot = None
+
+  def readBallotLine(self):
+    "Return the weight, ballot, and ID of the next line with ballots."
+    while True:
+      line = self.f.readline()
+      if self.loader.blankLineRE.match(line) is not None:
+        continue
+      if self.customBallotIDs:
+        (ballotID, ballot) = self.loader.getBallotWithCustomID(line)
+        weight = 1
+      else:
+        (weight, ballot) = self.loader.getBallot(line)
+        ballotID = None
+      if weight > 0:
+        return (weight, ballot, ballotID)
+
+  def getBallotAndID(self, i):
+    """Return ballot i and its ID.  The ID is None without custom IDs."""
+
+    if self.current is not None:
+      (first, weight, ballot, ballotID) = self.current
+      if first <= i < first + weight:
+        return (self.copyBallot(ballot), ballotID)
+
+    if self.f is None:
+      self.f = open(self.loader.fName, "rb")
+    b = bisect_right(self.firstBallots, i) - 1
+    if (self.nextBallot is None or i < self.nextBallot or
+        self.firstBallots[b] > self.nextBallot):
+      self.f.seek(self.offsets[b])
+      self.nextBallot = self.firstBallots[b]
+
+    while True:
+      (weight, ballot, ballotID) = self.readBallotLine()
+      first = self.nextBallot
+      self.nextBallot += weight
+      if i < self.nextBallot:
+        break
+    self.current = (first, weight, ballot, ballotID)
+    return (self.copyBallot(ballot), ballotID)
+
+  def copyBallot(self, ballot):
+    "Return a copy of a ballot so the one kept for the next read is unchanged."
+    return [item[:] if isinstance(item, list) else item for item in ballot]
+
+##################################################################
+
+def parseBallotChunk((fName, start, stop, numCandidates)):
+  "Parse the ballot lines between two offsets in a worker process."
+
+  f = open(fName, "r")
+  f.seek(start)
+  lines = iter(f.read(stop - start).splitlines(True))
+  f.close()
+
+  loader = BltBallotLoader()
+  loader.fName = fName
+  store = ListBallotStore()
+  try:
+    for line in lines:
+      store.appendBallots(loader.readBallots(line, lines, numCandidates))
+      break
+  except RuntimeError, (msg,):
+    return (msg, None, None, None, None)
+
+  end = None
+  if loader.foundEndOfBallots:
+    end = stop - sum(len(line) for line in lines)
+  return (None, list(store.getBallotViews()), store.uniqueBallotCount,
+          array("l", store.ballotOrder), end)
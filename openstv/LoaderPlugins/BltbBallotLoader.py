@@ -0,0 +1,236 @@
+"Plugin module for binary BLT format ballots."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import sys
+import struct
+from array import array
+from openstv.plugins import LoaderPlugin
+from openstv.ballots import ArrayBallotStore
+
+class BltbBallotLoader(LoaderPlugin):
+  """Ballot loader class for binary BLT ballot files.
+
+  A binary BLT file holds the same information as a BLT file, but the
+  ballots are written as the arrays of the compact ballot store so they can
+  be read back in one go without any parsing.  The file contains:
+
+    (1) A header with the magic string, the format version, the numbers of
+    candidates, seats, and withdrawn candidates, flags, the byte order and
+    integer sizes of the arrays, and the sizes of the arrays.  The arrays
+    are written with 4-byte integers, whatever the size of a C long, so a
+    file can be read on any platform.
+
+    (2) The candidate names and the title, each a 4-byte length followed by
+    the bytes of the string.
+
+    (3) The withdrawn candidates, the rankings, the offsets, and the weights
+    of the unique ballots, and the ballot order unless the ballots are
+    packed.
+
+    (4) The custom ballot IDs, if any, as strings like the names.
+  """
+
+  status = 1
+  extensions = ["bltb"]
+  formatName = "Binary BLT"
+  binary = True
+
+  magic = "BLTB\r\n\x1a\n"
+  version = 1
+  header = struct.Struct("<8sIIII4BQQQ")
+  # magic, version, numCandidates, numSeats, numWithdrawn,
+  # flags, byte order (0 little, 1 big), size of rankings, size of others,
+  # numRankings, numWeightedBallots, numBallots
+  lengthStruct = struct.Struct("<I")
+
+  hasEqualRankingsFlag = 1
+  customBallotIDsFlag = 2
+  packedFlag = 4
+
+  intSize = 4 # The size of the integers in the arrays written
+
+  def __init__(self):
+    LoaderPlugin.__init__(self)
+
+  def sniff(self, head):
+    "Check for the magic string at the start of the file."
+    if not head.startswith(self.magic):
+      self.reportLoadError("This is not a binary BLT file.")
+    return 100
+
+  def loadFromObject(self, ballotList, f):
+    "Load binary BLT ballot data from a file-like object."
+
+    data = f.read(self.header.size)
+    if len(data) < self.header.size or not data.startswith(self.magic):
+      self.reportLoadError("This is not a binary BLT file.")
+    (magic, version, numCandidates, numSeats, numWithdrawn, flags,
+     byteOrder, rankingsSize, arraySize, numRankings, numWeightedBallots,
+     numBallots) = self.header.unpack(data)
+    if version != self.version:
+      self.reportLoadError("Unknown version %d of the file format." % version)
+    swap = (byteOrder == 1) != (sys.byteorder == "big")
+
+    names = [self.readString(f) for c in range(numCandidates)]
+    title = self.readString(f)
+
+    withdrawn = self.readArray(f, 4, numWithdrawn, swap)
+    rankings = self.readArray(f, rankingsSize, numRankings, swap)
+    offsets = self.readArray(f, arraySize, numWeightedBallots + 1, swap)
+    uniqueBallotCount = self.readArray(f, arraySize, numWeightedBallots, swap)
+    if flags & self.packedFlag:
+      ballotOrder = array("l")
+      for u, weight in enumerate(uniqueBallotCount):
+        ballotOrder.extend(array("l", [u]) * weight)
+    else:
+      ballotOrder = self.readArray(f, arraySize, numBallots, swap)
+    if len(ballotOrder) != numBallots:
+      self.reportLoadError("The number of ballots is inconsistent.")
+
+    if flags & self.customBallotIDsFlag:
+      ballotList.customBallotIDs = True
+      ballotIDs = [self.readString(f) for i in xrange(numBallots)]
+    else:
+      ballotList.customBallotIDs = False
+      ballotIDs = None
+
+    store = ArrayBallotStore.fromArrays(
+      self.toArray(rankings, "i"), self.toArray(offsets, "l"),
+      self.toArray(uniqueBallotCount, "l"), self.toArray(ballotOrder, "l"),
+      bool(flags & self.hasEqualRankingsFlag))
+
+    ballotList.numSeats = numSeats
+    ballotList.names = names
+    ballotList.withdrawn = list(withdrawn)
+    ballotList.title = title
+    ballotList.setStore(store, ballotIDs)
+
+  def typecode(self, itemsize):
+    "Return the array typecode for signed integers of a given size."
+    for typecode in "ilh":
+      if array(typecode).itemsize == itemsize:
+        return typecode
+    self.reportLoadError("Cannot read %d-byte integers." % itemsize)
+
+  def toArray(self, a, typecode):
+    "Convert an array to a typecode if it has a different one."
+    if a.typecode == typecode:
+      return a
+    return array(typecode, a)
+
+  def readArray(self, f, itemsize, n, swap):
+    "Read an array of n integers."
+    a = array(self.typecode(itemsize))
+    try:
+      a.fromfile(f, n)
+    except TypeError:
+      # Not a real file
+      data = f.read(n * itemsize)
+      if len(data) != n * itemsize:
+        self.reportLoadError("The file is truncated.")
+      a.fromstring(data)
+    except EOFError:
+      self.reportLoadError("The file is truncated.")
+    if swap:
+      a.byteswap()
+    return a
+
+  def writeArray(self, f, a):
+    "Write an array of integers."
+    try:
+      a.tofile(f)
+    except TypeError:
+      # Not a real file
+      f.write(a.tostring())
+
+  def readString(self, f):
+    "Read a string preceded by its length."
+    data = f.read(self.lengthStruct.size)
+    if len(data) != self.lengthStruct.size:
+      self.reportLoadError("The file is truncated.")
+    (n,) = self.lengthStruct.unpack(data)
+    s = f.read(n)
+    if len(s) != n:
+      self.reportLoadError("The file is truncated.")
+    return s
+
+  def writeString(self, f, s):
+    "Write a string preceded by its length."
+    if isinstance(s, unicode):
+      s = s.encode("utf-8")
+    else:
+      s = str(s)
+    f.write(self.lengthStruct.pack(len(s)))
+    f.write(s)
+
+  def save(self, ballotList, fName=None, packed=False):
+    "Save ballots in binary BLT format."
+
+    if fName is not None:
+      self.fName = self.normalizeFileName(fName)
+
+    store = ballotList.store
+    if not isinstance(store, ArrayBallotStore):
+      store = ArrayBallotStore.fromStore(store)
+    if ballotList.customBallotIDs:
+      # Ballots with IDs can't be packed
+      packed = False
+
+    typecode = self.typecode(self.intSize)
+    try:
+      arrays = [array(typecode, a) for a in
+                (store.rankings, store.offsets, store.uniqueBallotCount,
+                 store.ballotOrder)]
+    except OverflowError:
+      raise RuntimeError, """\
+Can't save ballots in binary BLT format.  There
+are too many ballots or rankings for 4-byte
+integers."""
+    (rankings, offsets, uniqueBallotCount, ballotOrder) = arrays
+
+    flags = 0
+    if store.hasEqualRankings:
+      flags |= self.hasEqualRankingsFlag
+    if ballotList.customBallotIDs:
+      flags |= self.customBallotIDsFlag
+    if packed:
+      flags |= self.packedFlag
+    byteOrder = 1 if sys.byteorder == "big" else 0
+
+    f = self.createFile("wb")
+    f.write(self.header.pack(self.magic, self.version,
+                             ballotList.numCandidates, ballotList.numSeats,
+                             len(ballotList.withdrawn), flags, byteOrder,
+                             self.intSize, self.intSize,
+                             len(rankings), len(uniqueBallotCount),
+                             len(ballotOrder)))
+
+    for name in ballotList.names:
+      self.writeString(f, name)
+    self.writeString(f, ballotList.title)
+
+    self.writeArray(f, array(typecode, ballotList.withdrawn))
+    self.writeArray(f, rankings)
+    self.writeArray(f, offsets)
+    self.writeArray(f, uniqueBallotCount)
+    if not packed:
+      self.writeArray(f, ballotOrder)
+
+    if ballotList.customBallotIDs:
+      for i in xrange(ballotList.numBallots):
+        self.writeString(f, ballotList.getBallotID(i))
+
+    f.close()
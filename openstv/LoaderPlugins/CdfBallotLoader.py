@@ -0,0 +1,274 @@
+"Plugin module for NIST cast vote record JSON ballots."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import json
+from openstv.plugins import LoaderPlugin
+
+class CdfBallotLoader(LoaderPlugin):
+  "Ballot loader class for NIST SP 1500-103 cast vote record JSON files."
+
+  status = 1
+  extensions = ["json"]
+  formatName = "NIST CVR JSON"
+  binary = True
+
+  contestId = None # The first contest in the CVRs if None
+
+  def __init__(self):
+    LoaderPlugin.__init__(self)
+
+  def sniff(self, head):
+    "Check that the file starts like a cast vote record report."
+    if "CastVoteRecordReport" in head:
+      return 90
+    if head.lstrip().startswith("{") and '"CVR"' in head:
+      return 70
+    self.reportLoadError("This is not a cast vote record report.")
+
+  def loadFromObject(self, ballotList, f):
+    "Load CVR JSON ballot data from a file-like object."
+
+    stream = JsonStream(f, self.reportLoadError)
+    self.election = []
+    s2i = {} # Contest selection IDs to candidate numbers
+    self.contest = self.contestId
+    self.numCVRs = 0
+
+    stream.expect("{")
+    if not stream.next("}"):
+      while True:
+        key = stream.readValue()
+        stream.expect(":")
+        if key == "CVR":
+          for cvr in stream.readArray():
+            self.appendCVR(ballotList, cvr, s2i)
+        elif key == "Election":
+          self.election = stream.readValue()
+          if self.contest is not None:
+            self.addSelections(s2i)
+        else:
+          stream.readValue()
+        if stream.next("}"):
+          break
+        stream.expect(",")
+
+    if self.contest is None:
+      self.reportLoadError("There are no contests in the CVRs.")
+    self.loadElection(ballotList, s2i)
+
+  def appendCVR(self, ballotList, cvr, s2i):
+    "Append the ballot of a CVR if it has the contest."
+
+    snapshots = cvr.get("CVRSnapshot", [])
+    current = cvr.get("CurrentSnapshotId")
+    snapshot = None
+    for s in snapshots:
+      if current is None or s.get("@id") == current:
+        snapshot = s
+    if snapshot is None:
+      return
+
+    for contest in snapshot.get("CVRContest", []):
+      if self.contest is None:
+        self.contest = contest.get("ContestId")
+        self.addSelections(s2i)
+      if contest.get("ContestId") == self.contest:
+        break
+    else:
+      return
+
+    if self.numCVRs == 0:
+      ballotList.customBallotIDs = "UniqueId" in cvr
+    self.numCVRs += 1
+    ballotID = None
+    if ballotList.customBallotIDs:
+      if "UniqueId" not in cvr:
+        self.reportLoadError("CVR %d has no UniqueId." % self.numCVRs)
+      ballotID = self.toString(cvr["UniqueId"])
+
+    ballotList.appendBallot(self.getBallot(contest, s2i), ballotID)
+
+  def getBallot(self, contest, s2i):
+    "Return the ballot for a CVRContest and number any new IDs in s2i."
+
+    # A rank with no selections is a skipped ranking, and a rank with
+    # several selections is an overvote, which becomes equal rankings.
+    ranks = {}
+    for selection in contest.get("CVRContestSelection", []):
+      c = s2i.setdefault(selection.get("ContestSelectionId"), len(s2i))
+      for position in selection.get("SelectionPosition", []):
+        if position.get("HasIndication", "yes") != "yes":
+          continue
+        rank = position.get("Rank", selection.get("Rank"))
+        try:
+          rank = int(rank)
+        except (ValueError, TypeError):
+          rank = 0
+        if rank < 1:
+          self.reportLoadError("CVR %d has a selection without a valid rank "
+                               "in contest %s." % (self.numCVRs, self.contest))
+        candidates = ranks.setdefault(rank, [])
+        if c not in candidates:
+          candidates.append(c)
+
+    ballot = []
+    for r in xrange(1, max(ranks) + 1 if ranks else 1):
+      candidates = ranks.get(r, [])
+      if len(candidates) == 0:
+        ballot.append(-1)
+      elif len(candidates) == 1:
+        ballot.append(candidates[0])
+      else:
+        # The order of the selections in a CVR means nothing
+        ballot.append(sorted(candidates))
+    return ballot
+
+  def getContest(self):
+    "Return the contest from the Election array or None."
+    for e in self.election:
+      for contest in e.get("Contest", []):
+        if contest.get("@id") == self.contest:
+          return contest
+    return None
+
+  def addSelections(self, s2i):
+    "Number the selections of the contest that are not numbered yet."
+    contest = self.getContest()
+    if contest is not None:
+      for selection in contest.get("ContestSelection", []):
+        s2i.setdefault(selection.get("@id"), len(s2i))
+
+  def loadElection(self, ballotList, s2i):
+    "Set the names, title, and seats from the Election array."
+
+    names = {}
+    for e in self.election:
+      for candidate in e.get("Candidate", []):
+        names[candidate.get("@id")] = candidate.get("Name")
+
+    # Candidates without votes are still candidates
+    self.addSelections(s2i)
+    contest = self.getContest()
+    if contest is not None:
+      ballotList.title = self.toString(contest.get("Name", self.contest))
+      try:
+        ballotList.numSeats = int(contest.get("NumberElected", 1))
+      except (ValueError, TypeError):
+        self.reportLoadError("Contest %s has an invalid NumberElected."
+                             % self.contest)
+      selections = dict((s.get("@id"), s)
+                        for s in contest.get("ContestSelection", []))
+    else:
+      ballotList.title = self.toString(self.contest)
+      selections = {}
+
+    candidateNames = []
+    for selectionId in sorted(s2i, key=s2i.get):
+      selection = selections.get(selectionId, {})
+      candidateIds = selection.get("CandidateIds", [])
+      if len(candidateIds) > 0 and names.get(candidateIds[0]) is not None:
+        name = names[candidateIds[0]]
+      else:
+        name = selection.get("Name", selectionId)
+      candidateNames.append(self.toString(name))
+    ballotList.names = candidateNames
+
+  def toString(self, s):
+    "Return a JSON string as a string like those from other loaders."
+    if isinstance(s, unicode):
+      return s.encode("utf-8")
+    return str(s)
+
+##################################################################
+
+class JsonStream(object):
+  "Read the values of a large JSON document one at a time."
+
+  readSize = 2**16
+  whitespace = " \t\r\n"
+
+  def __init__(self, f, reportLoadError):
+    self.f = f
+    self.reportLoadError = reportLoadError
+    self.decoder = json.JSONDecoder()
+    self.buffer = ""
+    self.pos = 0
+    self.start = 0 # The offset in the document of the buffer
+    self.eof = False
+
+  def fill(self):
+    "Read another block, and return False at the end of the file."
+    # Read at least the bytes kept so that a long value is decoded only a
+    # few times.
+    if self.eof:
+      return False
+    data = self.f.read(max(self.readSize, len(self.buffer) - self.pos))
+    if data == "":
+      self.eof = True
+      return False
+    self.start += self.pos
+    self.buffer = self.buffer[self.pos:] + data
+    self.pos = 0
+    return True
+
+  def skipWhitespace(self):
+    while True:
+      n = len(self.buffer)
+      while self.pos < n and self.buffer[self.pos] in self.whitespace:
+        self.pos += 1
+      if self.pos < n or not self.fill():
+        return
+
+  def next(self, char):
+    "Skip a character if it is the next one and return whether it was."
+    self.skipWhitespace()
+    if self.buffer[self.pos:self.pos+1] == char:
+      self.pos += 1
+      return True
+    return False
+
+  def expect(self, char):
+    if not self.next(char):
+      self.reportLoadError("Expected '%s' at byte %d of the JSON document."
+                           % (char, self.start + self.pos))
+
+  def readValue(self):
+    "Decode the next value."
+    self.skipWhitespace()
+    while True:
+      try:
+        (value, end) = self.decoder.raw_decode(self.buffer, self.pos)
+      except ValueError:
+        if not self.fill():
+          self.reportLoadError("The JSON value at byte %d is not valid."
+                               % (self.start + self.pos))
+        continue
+      # A number at the end of the buffer may continue in the next block
+      if end < len(self.buffer) or not self.fill():
+        break
+    self.pos = end
+    return value
+
+  def readArray(self):
+    "Generate the values of the next array."
+    self.expect("[")
+    if self.next("]"):
+      return
+    while True:
+      yield self.readValue()
+      if self.next("]"):
+        return
+      self.expect(",")
@@ -0,0 +1,214 @@
+"Plugin module for cast vote record CSV ballots."
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import re
+import csv
+from array import array
+from itertools import islice
+from operator import itemgetter
+from openstv.plugins import LoaderPlugin
+
+class CsvBallotLoader(LoaderPlugin):
+  "Ballot loader class for cast vote record (CVR) CSV files."
+
+  status = 1
+  extensions = ["csv"]
+  formatName = "CVR CSV"
+  binary = True
+
+  chunkSize = 65536
+  rankRE = re.compile(r"\s*(?:rank|choice)[\s_]*(\d+)\s*$", re.IGNORECASE)
+  idColumns = ["ballotid", "id", "cvrid", "cvrnumber", "recordid"]
+  undervoteValues = set(["", "-", "undervote", "skipped"])
+  overvoteValues = set(["overvote"])
+  overvote = [-1, -1] # An overvote with unknown candidates, as in BLT "0=0"
+
+  def sniff(self, head):
+    "Check that the first line is a header with rank columns."
+    lines = self.getCompleteLines(head)
+    if len(lines) == 0:
+      self.reportLoadError("There is no header.")
+    try:
+      header = csv.reader(lines[:1]).next()
+    except csv.Error, err:
+      self.reportLoadError("Cannot read the header: %s." % err)
+    self.getColumns(header)
+    return 80
+
+  def getColumns(self, header):
+    "Return the rank columns in order of rank and the ballot ID column."
+
+    # Rank1, Rank2, ... or Choice1, Choice2, ... and an optional ID column.
+    # Other columns are ignored.
+    ranks = []
+    idColumn = None
+    for column, name in enumerate(header):
+      out = self.rankRE.match(name)
+      key = re.sub(r"[\W_]", "", name).lower()
+      if out is not None:
+        ranks.append((int(out.group(1)), column))
+      elif key in self.idColumns and idColumn is None:
+        idColumn = column
+    if len(ranks) == 0:
+      self.reportLoadError("The header has no rank columns.")
+    ranks.sort()
+    return ([column for rank, column in ranks], idColumn)
+
+  def loadFromObject(self, ballotList, f):
+    "Load CVR CSV ballot data from a file-like object."
+
+    reader = csv.reader(f)
+    try:
+      header = reader.next()
+    except StopIteration:
+      self.reportLoadError("There is no header.")
+    except csv.Error, err:
+      self.reportLoadError("Cannot read the header: %s." % err)
+    (rankColumns, idColumn) = self.getColumns(header)
+    ballotList.customBallotIDs = idColumn is not None
+
+    # One tuple of cells per row, made in C.  The tuples are dictionary
+    # keys, and itemgetter() of one column returns the cell itself.
+    getRankings = itemgetter(*rankColumns)
+    if len(rankColumns) == 1:
+      column = rankColumns[0]
+      getRankings = lambda row: (row[column],)
+
+    n2i = {}
+    items = {}
+    while True:
+      try:
+        rows = list(islice(reader, self.chunkSize))
+      except csv.Error, err:
+        self.reportLoadError("Cannot read line %d: %s." % (reader.line_num,
+                                                           err))
+      if len(rows) == 0:
+        break
+      if not all(rows):
+        rows = filter(None, rows) # Blank lines
+      try:
+        keys = map(getRankings, rows)
+        ballotIDs = None
+        if idColumn is not None:
+          ballotIDs = map(itemgetter(idColumn), rows)
+      except IndexError:
+        self.reportLoadError("A row near line %d has fewer cells than the "
+                             "header." % reader.line_num)
+
+      # Number the unique rows in the order they first appear
+      lookup = {}
+      ballotOrder = array("l", [lookup.setdefault(key, len(lookup))
+                                for key in keys])
+      uniqueBallotCount = [0] * len(lookup)
+      for u in ballotOrder:
+        uniqueBallotCount[u] += 1
+      uniqueBallots = [self.getBallot(key, items, n2i)
+                       for key in sorted(lookup, key=lookup.get)]
+      ballotList.appendUniqueBallots(uniqueBallots, uniqueBallotCount,
+                                     ballotOrder, ballotIDs)
+
+    ballotList.names = sorted(n2i, key=n2i.get)
+
+  def getBallot(self, cells, items, n2i):
+    "Return the ballot for the rank cells of a row."
+
+    # There are only a few different cells in a file, so items keeps the
+    # ranking of each cell seen so far.
+    try:
+      ballot = map(items.__getitem__, cells)
+    except KeyError:
+      for cell in cells:
+        if cell not in items:
+          items[cell] = self.getRanking(cell, n2i)
+      ballot = map(items.__getitem__, cells)
+    # Empty columns at the end are not rankings
+    while ballot and ballot[-1] == -1:
+      ballot.pop()
+    return ballot
+
+  def getRanking(self, cell, n2i):
+    "Return the ranking for a cell and number any new names in n2i."
+
+    # Undervotes are skipped rankings, names joined by "=" are equal
+    # rankings, and an overvote has unknown candidates, as in BLT files.
+    # Equal rankings are shared by ballots, which is safe since ballot
+    # stores copy them.
+    cell = cell.strip()
+    value = cell.lower()
+    if value in self.undervoteValues:
+      return -1
+    elif value in self.overvoteValues:
+      return self.overvote[:]
+    elif "=" in cell:
+      names = [name.strip() for name in cell.split("=") if name.strip()]
+      if len(names) == 0:
+        self.reportLoadError("Cannot process this cell:\n\t%s" % cell)
+      item = [n2i.setdefault(name, len(n2i)) for name in names]
+      return item if len(item) > 1 else item[0]
+    else:
+      return n2i.setdefault(cell, len(n2i))
+
+  def getCells(self, ballot, names):
+    "Return the rank cells for a ballot."
+    cells = []
+    for item in ballot:
+      if isinstance(item, list):
+        item = [c for c in item if c != -1]
+        if len(item) == 0:
+          cells.append("overvote")
+        else:
+          cells.append("=".join([names[c] for c in item]))
+      elif item == -1:
+        cells.append("")
+      else:
+        cells.append(names[item])
+    return cells
+
+  def save(self, ballotList, fName=None, packed=False):
+    "Save ballots in CVR CSV format."
+
+    if fName is not None:
+      self.fName = self.normalizeFileName(fName)
+
+    for name in ballotList.names:
+      if ("=" in name or name.strip() != name or
+          name.lower() in self.undervoteValues or
+          name.lower() in self.overvoteValues):
+        raise RuntimeError, """\
+Can't save ballots in CVR CSV format.  The
+candidates' names must not contain "=", start
+or end with white space, or be "overvote"."""
+
+    numRanks = 0
+    for u in xrange(ballotList.numWeightedBallots):
+      numRanks = max(numRanks, len(ballotList.getWeightedBallot(u)[1]))
+    numRanks = max(numRanks, 1)
+    header = ["Rank%d" % (r + 1) for r in range(numRanks)]
+    if ballotList.customBallotIDs:
+      header.insert(0, "BallotID")
+
+    f = self.createFile("wb")
+    writer = csv.writer(f, lineterminator="\n")
+    writer.writerow(header)
+    for i in xrange(ballotList.numBallots):
+      (ballot, ballotID) = ballotList.getBallotAndID(i)
+      cells = self.getCells(ballot, ballotList.names)
+      cells.extend([""] * (numRanks - len(cells)))
+      if ballotList.customBallotIDs:
+        cells.insert(0, ballotID)
+      writer.writerow(cells)
+
+    f.close()
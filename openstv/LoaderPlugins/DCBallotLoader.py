@@ -38,11 +38,19 @@ class DCBallotLoader(LoaderPlugin):
     this information.
     """
     
-    assert(ballotList.numCandidates > 0)
+    if ballotList.numCandidates == 0:
+      self.reportLoadError("The number of candidates must be set before "
+                           "loading DemoChoice ballots.")
     for line in f.readlines():
       ballot = self.getBallot(line)
       ballotList.appendBallot(ballot)
       
+  def sniff(self, head):
+    "Reject files of unknown format."
+    # The number of candidates is not in the file, and it must be set
+    # before loading, so a file of unknown format can't be DemoChoice.
+    self.reportLoadError("The number of candidates is not in the file.")
+
   def getBallot(self, line):
     line = line.strip()
     z = re.match("[\d,]*$", line)
@@ -57,7 +65,7 @@ class DCBallotLoader(LoaderPlugin):
     
     if fName is not None:
       self.fName = self.normalizeFileName(fName)
-    f = open(self.fName, "w")
+    f = self.createFile()
     
     for i in xrange(ballotList.numBallots):
       ballot = ballotList.getBallot(i)
@@ -25,60 +25,55 @@ class TextBallotLoader(LoaderPlugin):
   formatName = "Text"
   
   commentRE = re.compile("#.*")
+  weightRE = re.compile("\s*(\d+)\s*:")
+  namesRE = re.compile("[\w\s]*$")
 
   def __init__(self):
     LoaderPlugin.__init__(self)
 
   def loadFromObject(self, ballotList, f):
-    "Load text ballot data from a file-like object"
-
-    # Load ballots in two passes.  On the first pass, get all the candidate
-    # names, and on the second pass, add the ballots.  The ballots class
-    # needs to know how many candidates there are before we add any ballots.
-
-    # First pass
-    allNames = set()
-    for line in f.readlines():
-      
+    "Load text ballot data from a file-like object."
+
+    # Candidates are numbered in the order their names first appear
+    n2i = {}
+    ballotList.appendBallots(self.readBallots(f, n2i))
+    ballotList.names = sorted(n2i, key=n2i.get)
+
+  def readBallots(self, f, n2i):
+    "Generate (weight, ballot) pairs from the lines of f."
+    getWeightedBallot = self.getWeightedBallot
+    for line in f:
+      (weight, names) = getWeightedBallot(line)
+      yield (weight, [n2i.setdefault(name, len(n2i)) for name in names])
+
+  def sniff(self, head):
+    "Check that the first lines are text ballots."
+    for line in self.getCompleteLines(head):
+      self.getWeightedBallot(line)
+    # Most files could be text ballots so other formats come first
+    return 10
+
+  def getWeightedBallot(self, line):
+    "Return the weight and the candidate names of a line."
+
+    if "#" in line:
       line = self.commentRE.sub("", line) # strip comment
       
-      # get optional weight
-      y = re.match("\s*(\d+)\s*:", line)
-      if y is None:
-        weight = 1
-      else:
-        weight = int(y.group(1))
-        line = line[y.end():]
-
-      ballotNames = self.getBallot(line)
-      for name in ballotNames:
-        allNames.add(name)
-
-    ballotList.names = allNames
+    # get optional weight
+    y = self.weightRE.match(line)
+    if y is None:
+      weight = 1
+    else:
+      weight = int(y.group(1))
+      line = line[y.end():]
 
-    # Second pass
-    f.seek(0)
-    for line in f.readlines():
+    return (weight, self.getBallot(line))
 
-      line = self.commentRE.sub("", line) # strip comment
-      
-      # get optional weight
-      y = re.match("\s*(\d+)\s*:", line)
-      if y is None:
-        weight = 1
-      else:
-        weight = int(y.group(1))
-        line = line[y.end():]
-
-      names = self.getBallot(line)
-      for i in xrange(weight):
-        ballotList.appendBallotUsingNames(names)
-        
   def getBallot(self, line):
     line = line.strip()
     if line == "":
       return []
-    z = re.match("[\w\s]*$", line)
+    z = self.namesRE.match(line)
     if z is None:
       self.reportLoadError("Cannot process this line:\n\t%s" % line)
     else:
@@ -90,7 +85,7 @@ class TextBallotLoader(LoaderPlugin):
     
     if fName is not None:
       self.fName = self.normalizeFileName(fName)
-    f = open(self.fName, "w")
+    f = self.createFile()
 
     if not ballotList.isalnum():
       raise RuntimeError, """\
@@ -45,8 +45,7 @@ makes no difference.</p>
     "Count the votes using approval voting."
 
     # Count the approvals
-    for i in xrange(self.b.numWeightedBallots):
-      weight, blt = self.b.getWeightedBallot(i)
+    for weight, blt in self.b.getWeightedBallots():
       for j in blt:
         self.count[j] += weight
 
@@ -70,8 +70,7 @@ his or her first choice candidate.</p>
     "Count the votes using the Borda Count."
 
     # Add up the Borda counts
-    for i in xrange(self.b.numWeightedBallots):
-      weight, blt = self.b.getWeightedBallot(i)
+    for weight, blt in self.b.getWeightedBallots():
       # Ranked candidates get their usual Borda score
       for j, c in enumerate(blt):
         self.count[c] += self.p * weight * (self.b.numCandidates-j-1)
@@ -17,7 +17,7 @@ __revision__ = "$Id: CambridgeSTV.py 715 2010-02-27 17:00:55Z jeff.oneill $"
 import os.path
 import string
 
-from openstv.STV import OrderDependentSTV
+from openstv.STV import OrderDependentSTV, VotePile
 from openstv.plugins import MethodPlugin
 from openstv.ballots import Ballots
 
@@ -531,7 +531,7 @@ Need at least %d ballots but have only %d.""" % (
       # Get the next candidate.
       # If no next candidate, then the vote is not transferable and
       # remains with the current candidate.
-      c = self.b.getTopChoiceFromBallot(bi, ctng)
+      c = self.cursor.getTopChoiceFromBallot(bi, ctng)
       if c != None:
         self.votes[c].append(bi)
         # If the receiving candidate is now a winner, then that
@@ -567,7 +567,7 @@ Need at least %d ballots but have only %d.""" % (
       eliminationOrder.append(loser)
       remainingLosers.remove(loser)
       for bi in self.votes[loser]:
-        c = self.b.getTopChoiceFromBallot(bi, ctng)
+        c = self.cursor.getTopChoiceFromBallot(bi, ctng)
         if c != None:
           self.votes[c].append(bi)
           # If receiving candidate becomes a winner, then that
@@ -575,7 +575,7 @@ Need at least %d ballots but have only %d.""" % (
           if len(self.votes[c]) >= self.thresh[self.R-1]:
             ctng.remove(c)
 
-      self.votes[loser] = []
+      self.votes[loser] = VotePile()
 
     desc = "Count after eliminating %s and transferring votes. " % \
          self.b.joinList(eliminationOrder)
@@ -43,20 +43,17 @@ candidates, then the unranked candidates share the last-place vote.</p>
     self.stopCond = ["N"]
     self.batchElimination = "None"
     self.unranked = []
+    self.index = None
 
   def preCount(self):
     NoSurplusSTV.preCount(self)
     
     # Create data structures for speeding up mostLast()
-    self.unranked = [None] * self.b.numWeightedBallots
-    for i in xrange(self.b.numWeightedBallots):
-      u = []
-      b = self.b.getWeightedBallot(i)[1]
-      for c in self.continuing:
-        if c in b: 
-          continue
-        u.append(c)
-      self.unranked[i] = u
+    self.index = self.b.getCandidateIndex()
+    self.unranked = [[] for i in xrange(self.b.numWeightedBallots)]
+    for c in sorted(self.continuing):
+      for i in self.index.notRanking(c):
+        self.unranked[i].append(c)
     
   def mostLast(self):
     "Count the number of last-place votes per candidate."
@@ -65,14 +62,11 @@ candidates, then the unranked candidates share the last-place vote.</p>
 
     # Count last place votes per candidate
     total = [0] * self.b.numCandidates
-    for i in xrange(self.b.numWeightedBallots):
+    for i, (weight, blt) in enumerate(self.b.getWeightedBallots()):
       nUnranked = len(self.unranked[i])
-      weight, blt = self.b.getWeightedBallot(i)
       # If no unranked cands, last place candidate gets the vote
       if nUnranked == 0:
-        ballot = blt[:]
-        ballot.reverse()
-        for c in ballot:
+        for c in reversed(blt):
           if c in self.continuing:
             break
         total[c] += weight
@@ -100,10 +94,10 @@ candidates, then the unranked candidates share the last-place vote.</p>
     c = ctng[-1] 
     desc += "and %s, %f. "  % (self.b.names[c], total[c])
 
-    # Update data structures
-    for i in xrange(self.b.numWeightedBallots):
-      if c0 in self.unranked[i]: 
-        self.unranked[i].remove(c0)
+    # Update data structures.  Only the ballots that do not rank c0 have
+    # it as an unranked candidate.
+    for i in self.index.notRanking(c0):
+      self.unranked[i].remove(c0)
 
     return (c0, desc)
 
@@ -648,11 +648,8 @@ adequately represent the electorate until the next election.
 
     self.votesByTransferValue = {}
     for loser in cList:
-      for i in self.votes[loser]:
-        v = self.transferValue[i]
-        if v not in self.votesByTransferValue.keys():
-          self.votesByTransferValue[v] = []
-        self.votesByTransferValue[v].append(i)
+      for v, batches in self.votes[loser].items():
+        self.votesByTransferValue.setdefault(v, []).extend(batches)
 
     self.transferValues = self.votesByTransferValue.keys()
     self.transferValues.sort(reverse=True)
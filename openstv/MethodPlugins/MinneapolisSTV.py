@@ -65,13 +65,7 @@ condition, consistent with mathematical impossibility.</p>
     surplus = self.count[self.R-1][cSurplus] - self.thresh[self.R-1]
     # Calculate surplus fraction to specified precision
     surplusFraction = (surplus * self.p)/self.count[self.R-1][cSurplus]
-    for i in self.votes[cSurplus][:]:
-      self.transferValue[i] = self.transferValue[i] * surplusFraction / self.p
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
-      if c is not None:
-        self.votes[c].append(i)
-
-    self.votes[cSurplus] = []
+    self.transferParcels(cSurplus, lambda v: v * surplusFraction / self.p)
     
     desc = "Count after transferring surplus votes from %s with a transfer "\
          "value of %s/%s. " % \
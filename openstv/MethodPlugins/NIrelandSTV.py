@@ -446,15 +446,12 @@ of votes shall be made.
 
     self.votesByTransferValue = {}
     for loser in cList:
-      for i in self.votes[loser]:
-        v = self.transferValue[i]
-        if i in self.batches[loser][0]:
-          key = "first"
-        else:
-          key = v
-        if key not in self.votesByTransferValue.keys():
-          self.votesByTransferValue[key] = []
-        self.votesByTransferValue[key].append(i)
+      # The first batch is transferred first whatever its value
+      first = self.batches[loser][0]
+      for v, batches in self.votes[loser].items():
+        for batch in batches:
+          key = "first" if batch is first else v
+          self.votesByTransferValue.setdefault(key, []).append(batch)
 
     self.transferValues = self.votesByTransferValue.keys()
     if "first" in self.transferValues:
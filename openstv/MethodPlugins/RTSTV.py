@@ -16,7 +16,7 @@ __revision__ = "$Id: RTSTV.py 715 2010-02-27 17:00:55Z jeff.oneill $"
 
 import string
 
-from openstv.STV import OrderDependentSTV
+from openstv.STV import OrderDependentSTV, VotePile
 from openstv.plugins import MethodPlugin
 
 ##################################################################
@@ -87,7 +87,7 @@ set to "Batch".
     # transfer whole votes in excess of the threshold
     surplus = int(self.count[self.R-1][cSurplus] - self.thresh[self.R-1])
     for i in self.votes[cSurplus][:surplus]:
-      c = self.b.getTopChoiceFromBallot(i, self.continuing)
+      c = self.cursor.getTopChoiceFromBallot(i)
       self.votes[cSurplus].remove(i)
       if c != None:
         self.votes[c].append(i)
@@ -102,10 +102,10 @@ set to "Batch".
     # Transfer whole votes from losers.
     for loser in elimList:
       for i in self.votes[loser]:
-        c = self.b.getTopChoiceFromBallot(i, self.continuing)
+        c = self.cursor.getTopChoiceFromBallot(i)
         if c != None:
           self.votes[c].append(i)
-      self.votes[loser] = []
+      self.votes[loser] = VotePile()
 
     elimList.sort()
     desc = "Count after eliminating %s and transferring votes. " \
@@ -27,6 +27,7 @@ import wx.lib.mixins.listctrl as listmix
 
 from openstv.BFE import BFEFrame
 from openstv.ballots import Ballots
+from openstv.ballotcache import BallotCache
 from openstv.ReportPlugins.TextReport import TextReport
 from openstv.ReportPlugins.HtmlReport import HtmlReport
 from openstv.ReportPlugins.CsvReport import CsvReport
@@ -60,7 +61,12 @@ class Election():
   def loadBallots(self):
     self.dirtyBallots = Ballots()
     self.dirtyBallots.exceptionQueue = Queue(1)
-    loadThread = Thread(target=self.dirtyBallots.loadUnknown, args=(self.filename,))
+    if self.frame.ballotCache is not None:
+      loadThread = Thread(target=self.frame.ballotCache.loadBallots,
+                          args=(self.dirtyBallots, self.filename))
+    else:
+      loadThread = Thread(target=self.dirtyBallots.loadUnknown,
+                          args=(self.filename,))
     loadThread.start()
     
     # Display a progress dialog
@@ -81,7 +87,12 @@ class Election():
 
   def initializeElection(self, cleanType):
 
-    self.cleanBallots = self.dirtyBallots.getCleanBallots(removeOvervotes=cleanType)
+    if self.frame.ballotCache is not None:
+      self.cleanBallots = self.frame.ballotCache.getCleanBallots(
+        self.dirtyBallots, removeOvervotes=cleanType)
+    else:
+      self.cleanBallots = self.dirtyBallots.getCleanBallots(
+        removeOvervotes=cleanType)
     self.e = self.methodClass(self.cleanBallots)
             
   def runElection(self):
@@ -163,6 +174,7 @@ class Frame(wx.Frame):
     self.methodClasses = self.methodClasses1 # Methods currently viewable to user
 
     self.breakTiesRandomly = False
+    self.ballotCache = None # A BallotCache if parsed ballots are cached
     
     fn = os.path.join(getHome(), "Icons", "pie.ico")
     self.icon = wx.Icon(fn, wx.BITMAP_TYPE_ICO)
@@ -253,6 +265,9 @@ to www.OpenSTV.org, or send an email to OpenSTV@googlegroups.com.
                      self.OnShowAll, "Check")
     self.AddMenuItem(OptionsMenu, 'Break Ties Randomly', 'Break Ties Randomly',
                      self.OnBreakTiesRandomly, "Check")
+    self.AddMenuItem(OptionsMenu, 'Cache Ballots',
+                     'Keep parsed and cleaned ballots next to ballot files',
+                     self.OnCacheBallots, "Check")
     subMenu = wx.Menu()
     self.AddMenuItem(subMenu, '6', '6', self.OnFontSize)
     self.AddMenuItem(subMenu, '7', '7', self.OnFontSize)
@@ -537,6 +552,13 @@ to www.OpenSTV.org, or send an email to OpenSTV@googlegroups.com.
     itemId = event.GetId()
     self.breakTiesRandomly = self.GetMenuBar().FindItemById(itemId).IsChecked()
 
+  def OnCacheBallots(self, event):
+    itemId = event.GetId()
+    if self.GetMenuBar().FindItemById(itemId).IsChecked():
+      self.ballotCache = BallotCache()
+    else:
+      self.ballotCache = None
+
   def OnFontSize(self, event):
     itemId = event.GetId()
     fontSize = int(self.menuBar.FindItemById(itemId).GetLabel())
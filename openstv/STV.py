@@ -1,5 +1,7 @@
 """Module that provides code that can be used for different counting methods.
 
+Class VotePile
+Class Parcel
 Class ElectionMethod
   Class NonIterative
   Class Iterative
@@ -27,6 +29,139 @@ Class ElectionMethod
 __revision__ = "$Id: STV.py 822 2010-11-21 05:25:43Z jeff.oneill $"
 
 import random
+from itertools import izip, count
+
+from openstv.ballots import TransferCursor
+
+##################################################################
+
+class VotePile(object):
+  """The votes held by a candidate in the order they were received.
+  
+  A pile is used like a list of vote indices (or of batches of votes) where
+  each vote is in the list once, but finding and removing a vote take
+  constant time.  A removed vote leaves a hole that is skipped, and the
+  holes are squeezed out when they are more than half of the list or when
+  the list is read.  The pile must not be changed while iterating over it,
+  so iterate over a copy such as pile[:] to move votes out of it.
+  """
+
+  def __init__(self, votes=()):
+    self.items = []    # The votes in order with None for removed votes
+    self.position = {} # position[i] is the index of vote i in items
+    self.extend(votes)
+
+  def __len__(self):
+    return len(self.position)
+
+  def __contains__(self, i):
+    return i in self.position
+
+  def __iter__(self):
+    self.compact()
+    return iter(self.items)
+
+  def __getitem__(self, index):
+    self.compact()
+    return self.items[index]
+
+  def __repr__(self):
+    return "VotePile(%r)" % self[:]
+
+  def append(self, i):
+    self.position[i] = len(self.items)
+    self.items.append(i)
+
+  def extend(self, votes):
+    votes = list(votes)
+    self.position.update(izip(votes, count(len(self.items))))
+    self.items.extend(votes)
+
+  def remove(self, i):
+    try:
+      p = self.position.pop(i)
+    except KeyError:
+      raise ValueError, "VotePile.remove(i): i not in pile"
+    self.items[p] = None
+    if 2 * len(self.position) < len(self.items):
+      self.compact()
+
+  def compact(self):
+    "Squeeze out the holes left by removed votes."
+    if len(self.items) == len(self.position):
+      return
+    self.items = [i for i in self.items if i is not None]
+    self.position = dict((i, p) for p, i in enumerate(self.items))
+
+##################################################################
+
+class Parcel(object):
+  """Votes held by a candidate that all have the same transfer value.
+  
+  A hand count moves ballot papers in parcels rather than one at a time,
+  and methods with transfer values do the same.  The value of a parcel is
+  its transfer value times the total weight of its ballots, and a new
+  transfer value is computed once for the whole parcel.  A parcel is only
+  split up when its ballots have different next preferences.
+  
+  Attributes:
+  
+    transferValue -- The transfer value of each vote in the parcel.
+  
+    votes -- The indices of the weighted ballots in the parcel.
+  
+    weight -- The total weight of the ballots in the parcel.
+  
+  """
+
+  def __init__(self, transferValue, votes=None, weight=0):
+    self.transferValue = transferValue
+    if votes is None:
+      votes = []
+    self.votes = votes
+    self.weight = weight
+
+  def __len__(self):
+    return len(self.votes)
+
+  def __iter__(self):
+    return iter(self.votes)
+
+  def __repr__(self):
+    return "Parcel(%r, %r, %r)" % (self.transferValue, self.votes, self.weight)
+
+  def value(self):
+    "Return the value of the votes in the parcel."
+    return self.transferValue * self.weight
+
+  def merge(self, parcel):
+    "Add the votes of another parcel with the same transfer value."
+    assert(parcel.transferValue == self.transferValue)
+    self.votes.extend(parcel.votes)
+    self.weight += parcel.weight
+
+  def split(self, cursor, getWeight, transferValue=None):
+    """Split the parcel by the next preferences of its ballots.
+    
+    Return a dictionary mapping each continuing candidate to a new parcel
+    of the votes that go to the candidate next, with the same transfer value
+    or with transferValue if it is given.  Exhausted votes are left out.
+    """
+
+    if transferValue is None:
+      transferValue = self.transferValue
+    parcels = {}
+    getTopChoice = cursor.getTopChoiceFromWeightedBallot
+    for i in self.votes:
+      c = getTopChoice(i)
+      if c is None:
+        continue
+      parcel = parcels.get(c)
+      if parcel is None:
+        parcel = parcels[c] = Parcel(transferValue)
+      parcel.votes.append(i)
+      parcel.weight += getWeight(i)
+    return parcels
 
 ##################################################################
 
@@ -509,7 +644,9 @@ class STV(Iterative):
     thresh -- A list contiaining the winning threshold at each round.
   
     votes -- Contains the votes assigned to each candidate.  votes[c] is a list
-    containing the index numbers of all votes assigned to candidate c.
+    or VotePile containing the index numbers of all votes assigned to
+    candidate c, or the parcels of those votes for methods with transfer
+    values.
 
     batchElimination -- Some methods allow multiple candidates to be eliminated
     in a single round.  Allowable values are "None" (no batch elimination), 
@@ -523,6 +660,9 @@ class STV(Iterative):
     firstEliminationRound -- Initially set to true.  Set to false after the
     first elimination round.
   
+    cursor -- A TransferCursor for finding the top choices on ballots among
+    the continuing candidates, or None if the method does not use one.
+  
   """
 
   def __init__(self, b):
@@ -537,6 +677,7 @@ class STV(Iterative):
     self.thresh = []     # thresh[r] is the winning threshold
     # votes[c] stores the indices of all votes for candidate c.
     self.votes = []
+    self.cursor = None
 
   def preCount(self):
     Iterative.preCount(self)
@@ -549,6 +690,19 @@ class STV(Iterative):
     self.surplus.append(0)
     self.thresh.append(0)
 
+  def newWinners(self, newWinnersList, status="over"):
+    "Perform basic accounting when a new winner is found."
+    desc = Iterative.newWinners(self, newWinnersList, status)
+    if self.cursor is not None:
+      self.cursor.newGeneration()
+    return desc
+
+  def newLosers(self, newLosersList):
+    "Perform basic accounting when a new loser is found."
+    Iterative.newLosers(self, newLosersList)
+    if self.cursor is not None:
+      self.cursor.newGeneration()
+
   def initialVoteTally(self):
     "Count the first place votes (must be overridden)."
     raise NotImplementedError
@@ -871,16 +1025,20 @@ class OrderDependentSTV(STV):
   def preCount(self):
     STV.preCount(self)
     assert(self.threshName[2] == "Whole")
+    self.cursor = TransferCursor(self.b, self.continuing)
       
   def initialVoteTally(self):
     "Count the first place votes with order dependent rules."
 
     # Allocate votes to candidates bases on the first choices.
     for i in xrange(self.b.numBallots):
-      c = self.b.getTopChoiceFromBallot(i, self.continuing)
+      c = self.cursor.getTopChoiceFromBallot(i)
       if c is not None: 
         self.votes[c].append(i)
 
+    # Surplus transfers remove votes from the middle of the piles
+    self.votes = [VotePile(votes) for votes in self.votes]
+
     self.roundInfo[self.R]["action"] = ("first", [])
     
   def updateCount(self):
@@ -896,18 +1054,29 @@ class OrderIndependentSTV(STV):
   independent of the order of the ballots.  Order independent methods can use
   weighted ballots to speed up the count.
   
-  No additional attributes.
+  Attributes:
+
+    tally -- tally[c] is the value of the votes in votes[c].  Whatever moves
+    votes between candidates adds and subtracts their values here, so the
+    counts are updated without going through all of the votes each round.
+    The values are integers so the tally is exact.
   
   """
 
+  def preCount(self):
+    STV.preCount(self)
+    self.cursor = TransferCursor(self.b, self.continuing)
+    self.tally = [0] * self.b.numCandidates
+
   def initialVoteTally(self):
     "Count the first place votes."
 
     # Allocate votes to candidates based on the first choices.
     for i in range(self.b.numWeightedBallots):
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+      c = self.cursor.getTopChoiceFromWeightedBallot(i)
       if c is not None: 
         self.votes[c].append(i)
+        self.tally[c] += self.b.getWeight(i)
     self.roundInfo[self.R]["action"] = ("first", [])
 
 ##################################################################
@@ -944,10 +1113,12 @@ class NoSurplusSTV(OrderIndependentSTV):
 
     for loser in elimList:
       for i in self.votes[loser]:
-        c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
+        c = self.cursor.getTopChoiceFromWeightedBallot(i)
         if c is not None:
           self.votes[c].append(i)
+          self.tally[c] += self.b.getWeight(i)
       self.votes[loser] = []
+      self.tally[loser] = 0
 
     desc = "Count after eliminating %s and transferring votes. " \
          % self.b.joinList(elimList)
@@ -960,10 +1131,7 @@ class NoSurplusSTV(OrderIndependentSTV):
   def updateCount(self):
     "Update the vote totals after a transfer of votes for NoSurplus methods."
 
-    # Recount votes for all candidates
-    for c in range(self.b.numCandidates):
-      for i in self.votes[c]:
-        self.count[self.R][c] += self.b.getWeight(i)
+    self.count[self.R][:] = self.tally
 
 ##################################################################
 
@@ -985,19 +1153,28 @@ class GregorySTV(OrderIndependentSTV):
 
     votesByTransferValue -- In eliminating candidates, Gregory methods transfer
     votes in packets having the same transfer value.  votesByTransferValue[v]
-    is a list of vote indices having that transfer value.
+    is a list of the batches of the eliminated candidates having that
+    transfer value.
   
     batches -- In doing secondary transfers, Gregory methods transfer the last
     batch of votes received by a candidate.  batches[c] is a list of batches
-    of votes received by candidate c.  Each batch is a list of vote indices.
-  
-    transferValue -- Each ballot has a transfer value.  Initially, it is set 
-    to 1, but may be reduced when a vote is part of a surplus transfer.
+    of votes received by candidate c.  Each batch is a Parcel, since all of
+    the votes received in one transfer have the same transfer value.
+
+    holder -- holder[batch] is the candidate who holds a batch, or None if
+    the batch has been transferred or is part of the quota of a winner.
+
+  The votes of candidate c, votes[c], are a dictionary mapping each transfer
+  value to a VotePile of the batches with that value that c still holds.
+  The batches are sorted this way as they arrive, so eliminating a candidate
+  moves whole piles of batches without going through the votes, and a batch
+  is taken from its holder in constant time.
   
   """
   
   def __init__(self, b):
     OrderIndependentSTV.__init__(self, b)
+    self.holder = {}
     self.quota = 0
     self.S = 0
     self.stages = []
@@ -1005,33 +1182,52 @@ class GregorySTV(OrderIndependentSTV):
     # Gregory rules do last batch transfers
     # Need to store batches for each cand
     self.batches = []
-    self.transferValue = []
     self.transferValues = []
 
   def preCount(self):
     OrderIndependentSTV.preCount(self)
     
-    self.transferValue = [self.p] * self.b.numWeightedBallots
+    self.votes = [{} for _c in range(self.b.numCandidates)]
     for _c in range(self.b.numCandidates):
       self.batches.append([])
   
+  def addBatch(self, c, batch):
+    "Give a new batch of votes to a candidate."
+    self.votes[c].setdefault(batch.transferValue, VotePile()).append(batch)
+    self.batches[c].append(batch)
+    self.holder[batch] = c
+    self.tally[c] += batch.value()
+
+  def removeBatch(self, batch):
+    "Take a batch of votes away from its holder."
+    c = self.holder[batch]
+    batches = self.votes[c][batch.transferValue]
+    batches.remove(batch)
+    if len(batches) == 0:
+      del self.votes[c][batch.transferValue]
+    self.holder[batch] = None
+    self.tally[c] -= batch.value()
+
   def initialVoteTally(self):
     "Count the first place votes with Gregory rules."
 
-    OrderIndependentSTV.initialVoteTally(self)
-    
     # The first batch is all the votes a candidate has.
+    ballots = Parcel(self.p, range(self.b.numWeightedBallots))
+    firstBatches = ballots.split(self.cursor, self.b.getWeight)
     for c in range(self.b.numCandidates):
-      self.batches[c].append(self.votes[c][:])
+      if c in firstBatches:
+        self.addBatch(c, firstBatches[c])
+      else:
+        self.batches[c].append(Parcel(self.p))
+    self.roundInfo[self.R]["action"] = ("first", [])
 
   def transferSurplusVotesFromCandidate(self, cSurplus):
     "Transfer surplus votes according to the Gregory rules."
 
-    # Each candidate will receive a new batch of votes so
-    # create a data structure to store the vote indices.
-    newBatch = []
-    for c in range(self.b.numCandidates):
-      newBatch.append([])
+    # Each candidate will receive a new batch of votes with the
+    # votes of the last batch that go to the candidate next.
+    lastBatch = self.batches[cSurplus][-1]
+    newBatches = lastBatch.split(self.cursor, self.b.getWeight)
 
     # We need to compute several quantities:
     #   surplus -- the number of votes of the transferor over quota
@@ -1040,31 +1236,24 @@ class GregorySTV(OrderIndependentSTV):
       surplus = self.count[self.R-1][cSurplus] - self.quota[self.R-1]
     elif self.methodName == "N. Ireland STV":
       surplus = self.count[self.R-1][cSurplus] - self.thresh[self.R-1]
-    lastBatch = self.batches[cSurplus][-1]
-    transferableValue = 0
-    nTransferable = 0
-    for i in lastBatch:
-      if self.b.getTopChoiceFromWeightedBallot(i, self.continuing) \
-         is not None:
-        transferableValue += \
-                          self.b.getWeight(i) * self.transferValue[i]
-        nTransferable += self.p * self.b.getWeight(i)
-
-    # Do the transfer
-    for i in lastBatch:
+    transferableWeight = 0
+    for batch in newBatches.values():
+      transferableWeight += batch.weight
+    transferableValue = lastBatch.transferValue * transferableWeight
+    nTransferable = self.p * transferableWeight
+
+    # Do the transfer.  The votes that are not transferred stay with the
+    # winner as the quota.
+    for c, batch in newBatches.items():
       if transferableValue > surplus:
-        self.transferValue[i] = self.p * surplus / nTransferable
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
-      if c is not None:
-        self.votes[c].append(i)
-        newBatch[c].append(i)
-
-    # for candidates who received votes, add new batch
-    for c in self.continuing:
-      if len(newBatch[c]) > 0:
-        self.batches[c].append(newBatch[c])
+        batch.transferValue = self.p * surplus / nTransferable
+      self.addBatch(c, batch)
 
-    self.votes[cSurplus] = []
+    for batches in self.votes[cSurplus].values():
+      for batch in batches:
+        self.holder[batch] = None
+    self.votes[cSurplus] = {}
+    self.tally[cSurplus] = 0
 
     desc = "Count after transferring surplus votes from %s. " % \
          self.b.names[cSurplus]
@@ -1077,10 +1266,7 @@ class GregorySTV(OrderIndependentSTV):
     # Because of substage transfers with ERS97, losing candidates
     # will sometimes have a count greater than 0.
     for c in self.losers | self.continuing | self.winnersOver:
-      self.count[self.R][c] = 0
-      for i in self.votes[c]:
-        self.count[self.R][c] += \
-            self.b.getWeight(i) * self.transferValue[i]
+      self.count[self.R][c] = self.tally[c]
 
     # Set counts for winnersEven.  This will always be the same as the
     # previous round.
@@ -1103,26 +1289,20 @@ class GregorySTV(OrderIndependentSTV):
   def transferVotesWithValue(self, v):
     "Eliminate candidates according to the Gregory rules."
 
-    # Set up holders for transferees
-    newBatch = []
-    for c in range(self.b.numCandidates):
-      newBatch.append([])
-
-    # Transfer votes of this value
-    for i in self.votesByTransferValue[v]:
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
-      if c is not None:
-        self.votes[c].append(i)
-        newBatch[c].append(i)
-      # Don't know where this vote came from so try all losers
-      for d in self.losers:
-        if i in self.votes[d]:
-          self.votes[d].remove(i)
+    # Transfer the batches of this value and collect the votes
+    # going to each candidate in a new batch
+    newBatches = {}
+    for batch in self.votesByTransferValue[v]:
+      self.removeBatch(batch)
+      for c, parcel in batch.split(self.cursor, self.b.getWeight).items():
+        if c in newBatches:
+          newBatches[c].merge(parcel)
+        else:
+          newBatches[c] = parcel
 
     # For candidates who received votes, add new batch
-    for c in self.continuing:
-      if len(newBatch[c]) > 0:
-        self.batches[c].append(newBatch[c])
+    for c, batch in newBatches.items():
+      self.addBatch(c, batch)
 
   def eliminateCandidates(self):
     (elimList, selectLosersDesc) = self.selectCandidatesToEliminate()
@@ -1171,34 +1351,63 @@ class WeightedInclusiveSTV(OrderIndependentSTV):
   """Class that provides additional functionality for weighted inclusive 
   methods.
   
-  Attributes:
-  
-    transferValue -- Each ballot has a transfer value.  Initially, it is set 
-    to 1, but may be reduced when a vote is part of a surplus transfer.
+  No additional attributes.
+
+  Each ballot has a transfer value.  Initially, it is set to 1, but may be
+  reduced when a vote is part of a surplus transfer.  The votes of candidate
+  c, votes[c], are a dictionary mapping each transfer value to a Parcel of
+  the votes c holds with that transfer value.
 
   """
 
   def __init__(self, b):    
     OrderIndependentSTV.__init__(self, b)
-    self.transferValue = []
 
   def preCount(self):
     OrderIndependentSTV.preCount(self)
-    self.transferValue = [self.p] * self.b.numWeightedBallots
+    self.votes = [{} for _c in range(self.b.numCandidates)]
     
+  def addParcel(self, c, parcel):
+    "Give a parcel of votes to a candidate."
+    held = self.votes[c].get(parcel.transferValue)
+    if held is None:
+      self.votes[c][parcel.transferValue] = parcel
+    else:
+      held.merge(parcel)
+    self.tally[c] += parcel.value()
+
+  def transferParcels(self, c, transferValue=None):
+    """Transfer all of the votes of a candidate to their next preferences.
+
+    transferValue(v) is the new transfer value of votes with transfer value
+    v, and the transfer values are unchanged if it is None.
+    """
+
+    for parcel in self.votes[c].values():
+      v = parcel.transferValue
+      if transferValue is not None:
+        v = transferValue(v)
+      for d, newParcel in parcel.split(self.cursor, self.b.getWeight,
+                                       v).items():
+        self.addParcel(d, newParcel)
+    self.votes[c] = {}
+    self.tally[c] = 0
+
+  def initialVoteTally(self):
+    "Count the first place votes."
+
+    ballots = Parcel(self.p, range(self.b.numWeightedBallots))
+    for c, parcel in ballots.split(self.cursor, self.b.getWeight).items():
+      self.addParcel(c, parcel)
+    self.roundInfo[self.R]["action"] = ("first", [])
+
   def transferSurplusVotesFromCandidate(self, cSurplus):
     "Transfer the surplus votes of one candidate."
 
     # Transfer all of the votes at a fraction of their value
     surplus = self.count[self.R-1][cSurplus] - self.thresh[self.R-1]
-    for i in self.votes[cSurplus][:]:
-      self.transferValue[i] = self.transferValue[i] * surplus / \
-          self.count[self.R-1][cSurplus]
-      c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
-      if c is not None:
-        self.votes[c].append(i)
-
-    self.votes[cSurplus] = []
+    total = self.count[self.R-1][cSurplus]
+    self.transferParcels(cSurplus, lambda v: v * surplus / total)
     
     desc = "Count after transferring surplus votes from %s with a transfer "\
          "value of %s/%s. " \
@@ -1211,10 +1420,7 @@ class WeightedInclusiveSTV(OrderIndependentSTV):
 
     # Update counts for losers, continuing, and winnersOver.
     for c in self.losers | self.continuing | self.winnersOver:
-      self.count[self.R][c] = 0
-      for i in self.votes[c]:
-        self.count[self.R][c] += \
-            self.b.getWeight(i) * self.transferValue[i]
+      self.count[self.R][c] = self.tally[c]
 
     # Set counts for winnersEven.  This will always be the same as the
     # previous round.
@@ -1233,11 +1439,7 @@ class WeightedInclusiveSTV(OrderIndependentSTV):
 
     # Transfer votes from losers simultaneously.
     for loser in elimList:
-      for i in self.votes[loser]:
-        c = self.b.getTopChoiceFromWeightedBallot(i, self.continuing)
-        if c is not None:
-          self.votes[c].append(i)
-      self.votes[loser] = []
+      self.transferParcels(loser)
 
     elimList.sort()
     desc = "Count after eliminating %s and transferring votes. " \
@@ -1275,6 +1477,10 @@ class RecursiveSTV(OrderIndependentSTV):
     self.keepFactor = []
     self.tree = {}
 
+  def preCount(self):
+    "Recursive methods count with the tree instead of a cursor and tallies."
+    STV.preCount(self)
+
   def allocateRound(self):
     "Add keep factor allocation."
     OrderIndependentSTV.allocateRound(self)
@@ -1352,7 +1558,7 @@ class RecursiveSTV(OrderIndependentSTV):
 
     if ballot == "":
       # Add the complete ballot to the tree
-      weight, ballot = self.b.getWeightedBallot(ballotIndex)
+      weight, ballot = self.b.getWeightedBallotView(ballotIndex)
     else:
       # When ballot is not "", we are adding a truncated ballot to the tree,
       # because a higher-ranked candidate is a winner.
@@ -1401,7 +1607,7 @@ class RecursiveSTV(OrderIndependentSTV):
     "Update the tree data structure to account for new losers."
     for c in loserSet.intersection(tree):
       for i in tree[c]["bi"]:
-        ballot = self.b.getWeightedBallot(i)[1] # drop weight
+        ballot = self.b.getWeightedBallotView(i)[1] # drop weight
         j = ballot.index(c)
         ballot2 = ballot[j+1:]
         self.addBallotToTree(tree, i, ballot2)
@@ -1416,7 +1622,7 @@ class RecursiveSTV(OrderIndependentSTV):
         # updateTree() recursively since addBallotToTree() will appropriately
         # expand lower nodes.
         for i in tree[c]["bi"]:
-          ballot = self.b.getWeightedBallot(i)[1]
+          ballot = self.b.getWeightedBallotView(i)[1]
           j = ballot.index(c)
           ballot2 = ballot[j+1:]
           self.addBallotToTree(tree[c], i, ballot2)
@@ -0,0 +1,301 @@
+"""Module for caching parsed and cleaned ballots on disk"""
+
+## Copyright (C) 2003-2010  Jeffrey O'Neill
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+
+__revision__ = "$Id$"
+
+import os
+import sys
+import struct
+import hashlib
+import tempfile
+import json
+from array import array
+
+from openstv.ballots import ArrayBallotStore
+from openstv.plugins import getLoaderPlugins
+
+##################################################################
+
+class BallotCache(object):
+  """On-disk cache of parsed and cleaned ballots.
+
+  Parsing and cleaning a large ballot file takes much longer than reading
+  the arrays of a compact ballot store.  The cache keeps the arrays of the
+  ballots loaded from a file and of the ballots cleaned from them, so that
+  running several methods on the same file parses and cleans it only once.
+
+  The entry for the ballots of a file is valid while the size, modification
+  time, and SHA-1 digest of the file are unchanged.  The entries for clean
+  ballots are keyed by the digest, the withdrawn candidates, and the
+  cleaning options.  Cleaning assumes that the ballots have not been changed
+  since they were loaded, other than by withdrawing candidates.
+
+  Entries are kept in cacheDir, or in a directory named .openstv-cache next
+  to the ballot file if cacheDir is None.  When the entries in a directory
+  take more than maxSize bytes, the least recently used ones are removed.
+  An entry is a JSON header followed by the arrays, so reading an entry
+  that someone else wrote can't run code.
+  """
+
+  version = 2
+  lengthStruct = struct.Struct("<I")
+  # Arrays are only read back on a machine with the same integers
+  machine = [array("i").itemsize, array("l").itemsize, sys.byteorder]
+
+  def __init__(self, cacheDir=None, maxSize=2**30):
+    self.cacheDir = cacheDir
+    self.maxSize = maxSize
+
+  def getCacheDir(self, fName):
+    "Return the directory with the entries for a ballot file."
+    if self.cacheDir is not None:
+      return self.cacheDir
+    return os.path.join(os.path.dirname(os.path.abspath(fName)),
+                        ".openstv-cache")
+
+  def getDigest(self, fName):
+    "Return the SHA-1 digest of the contents of a file."
+    digest = hashlib.sha1()
+    f = open(fName, "rb")
+    while True:
+      data = f.read(2**20)
+      if data == "":
+        break
+      digest.update(data)
+    f.close()
+    return digest.hexdigest()
+
+  def loadBallots(self, ballotList, fName, known=False, exclude0=True):
+    """Load ballots from a file into an empty Ballots object.
+
+    The ballots come from the cache if the file is unchanged.  Otherwise
+    the file is loaded with loadKnown() if known is True or with
+    loadUnknown() if not, and the ballots are added to the cache.
+    """
+
+    if fName == "-":
+      # Nothing to check standard input against
+      ballotList.loadKnown(fName, exclude0=exclude0)
+      return
+
+    stat = os.stat(fName)
+    digest = self.getDigest(fName)
+    key = (stat.st_size, stat.st_mtime, digest)
+    cacheDir = self.getCacheDir(fName)
+    entry = os.path.join(cacheDir,
+                         hashlib.sha1(os.path.abspath(fName)).hexdigest() +
+                         ".dirty")
+
+    info = self.readEntry(entry, key, ballotList, withLoader=True)
+    if info is not None:
+      ballotList.loader.fName = fName
+      ballotList.cacheKey = digest
+      return
+
+    if known:
+      ballotList.loadKnown(fName, exclude0=exclude0)
+    else:
+      ballotList.loadUnknown(fName, exclude0)
+    if (ballotList.exceptionQueue is not None and
+        not ballotList.exceptionQueue.empty()):
+      # The ballots could not be loaded
+      return
+    ballotList.cacheKey = digest
+    self.writeEntry(entry, key, ballotList,
+                    loader=ballotList.loader.__class__.__name__)
+
+  def getCleanBallots(self, ballotList, removeEmpty=True,
+                      removeOvervotes="Cambridge", removeDupes=True,
+                      removeWithdrawn=True):
+    """Return the clean ballots of ballots loaded with loadBallots().
+
+    See Ballots.getCleanBallots() for the options.  The clean ballots come
+    from the cache if these ballots were cleaned the same way before.
+    """
+
+    if ballotList.cacheKey is None:
+      return ballotList.getCleanBallots(removeEmpty, removeOvervotes,
+                                        removeDupes, removeWithdrawn)
+
+    key = (ballotList.cacheKey, sorted(ballotList.withdrawn), removeEmpty,
+           removeOvervotes, removeDupes, removeWithdrawn)
+    entry = os.path.join(self.getCacheDir(ballotList.getFileName()),
+                         hashlib.sha1(repr(key)).hexdigest() + ".clean")
+
+    # Clean ballots take these from the dirty ballots
+    cleanBallots = ballotList.copy(False)
+    cleanBallots.dirtyBallots = ballotList
+    if self.readEntry(entry, key, cleanBallots) is not None:
+      cleanBallots.title = ballotList.title
+      cleanBallots.date = ballotList.date
+      cleanBallots.numSeats = ballotList.numSeats
+      return cleanBallots
+
+    cleanBallots = ballotList.getCleanBallots(removeEmpty, removeOvervotes,
+                                              removeDupes, removeWithdrawn)
+    self.writeEntry(entry, key, cleanBallots)
+    return cleanBallots
+
+  def readEntry(self, entry, key, ballotList, withLoader=False):
+    """Read the ballots of an entry into a Ballots object.
+
+    Return the information in the entry, or None if the entry is missing,
+    damaged, or not for this key.  If withLoader is True, the loader named
+    in the entry is set too.
+    """
+
+    # The key as it reads back from JSON
+    key = json.loads(json.dumps(key))
+    try:
+      f = open(entry, "rb")
+    except IOError:
+      return None
+    try:
+      try:
+        (n,) = self.lengthStruct.unpack(f.read(self.lengthStruct.size))
+        info = json.loads(f.read(n))
+        if (info["version"] != self.version or
+            info["machine"] != self.machine or info["key"] != key):
+          return None
+        if withLoader:
+          loaders = getLoaderPlugins("byName", exclude0=False)
+          loaderClass = loaders[info["loader"]]
+        rankings = self.readArray(f, "i", info["numRankings"])
+        offsets = self.readArray(f, "l", info["numWeightedBallots"] + 1)
+        uniqueBallotCount = self.readArray(f, "l", info["numWeightedBallots"])
+        ballotOrder = self.readArray(f, "l", info["numBallots"])
+        ballotIDs = info["ballotIDs"]
+        if info["intBallotIDs"]:
+          ballotIDs = self.readArray(f, "l", info["numBallots"])
+        elif ballotIDs is not None:
+          ballotIDs = map(self.toString, ballotIDs)
+        names = map(self.toString, info["names"])
+        title = self.toString(info["title"])
+        date = self.toString(info["date"])
+        (numSeats, withdrawn, customBallotIDs, hasEqualRankings) = \
+            (info["numSeats"], info["withdrawn"], info["customBallotIDs"],
+             info["hasEqualRankings"])
+      finally:
+        f.close()
+    except (IOError, EOFError, struct.error, ValueError, KeyError, TypeError,
+            AttributeError, UnicodeError):
+      return None
+
+    store = ArrayBallotStore.fromArrays(rankings, offsets, uniqueBallotCount,
+                                        ballotOrder, hasEqualRankings)
+    ballotList.title = title
+    ballotList.date = date
+    ballotList.numSeats = numSeats
+    ballotList.names = names
+    ballotList.withdrawn = withdrawn
+    ballotList.customBallotIDs = customBallotIDs
+    ballotList.setStore(store, ballotIDs)
+    if withLoader:
+      ballotList.loader = loaderClass()
+
+    # Keep recently used entries
+    try:
+      os.utime(entry, None)
+    except OSError:
+      pass
+    return info
+
+  def readArray(self, f, typecode, n):
+    "Read an array of n integers."
+    a = array(typecode)
+    a.fromfile(f, n)
+    return a
+
+  def toString(self, s):
+    "Return a JSON string as a string like those from the loaders."
+    if isinstance(s, unicode):
+      return s.encode("utf-8")
+    return s
+
+  def writeEntry(self, entry, key, ballotList, **info):
+    """Write the ballots of a Ballots object to an entry.
+
+    The cache is only an aid, so an entry that can't be written is skipped.
+    """
+
+    store = ballotList.store
+    if not isinstance(store, ArrayBallotStore):
+      store = ArrayBallotStore.fromStore(store)
+    ballotIDs = None
+    intBallotIDs = None
+    if ballotList.customBallotIDs:
+      try:
+        intBallotIDs = array("l", ballotList.ballotIDsList)
+      except (TypeError, OverflowError):
+        ballotIDs = ballotList.ballotIDsList
+
+    info.update(version=self.version, machine=self.machine, key=key,
+                title=ballotList.title, date=ballotList.date,
+                numSeats=ballotList.numSeats, names=ballotList.names,
+                withdrawn=ballotList.withdrawn,
+                customBallotIDs=ballotList.customBallotIDs,
+                ballotIDs=ballotIDs, intBallotIDs=intBallotIDs is not None,
+                hasEqualRankings=store.hasEqualRankings,
+                numRankings=len(store.rankings),
+                numWeightedBallots=store.numWeightedBallots,
+                numBallots=store.numBallots)
+    try:
+      data = json.dumps(info)
+    except (TypeError, ValueError, UnicodeError):
+      # Such as names that are not UTF-8
+      return
+
+    cacheDir = os.path.dirname(entry)
+    tempName = None
+    try:
+      if not os.path.isdir(cacheDir):
+        os.makedirs(cacheDir)
+      # Write to a temporary file so that a partial entry is never read
+      (fd, tempName) = tempfile.mkstemp(suffix=".tmp", dir=cacheDir)
+      f = os.fdopen(fd, "wb")
+      try:
+        f.write(self.lengthStruct.pack(len(data)))
+        f.write(data)
+        store.rankings.tofile(f)
+        store.offsets.tofile(f)
+        store.uniqueBallotCount.tofile(f)
+        store.ballotOrder.tofile(f)
+        if intBallotIDs is not None:
+          intBallotIDs.tofile(f)
+      finally:
+        f.close()
+      if os.path.exists(entry):
+        os.remove(entry)
+      os.rename(tempName, entry)
+      tempName = None
+      self.evict(cacheDir)
+    except (IOError, OSError):
+      if tempName is not None and os.path.exists(tempName):
+        os.remove(tempName)
+
+  def evict(self, cacheDir):
+    "Remove the least recently used entries until the rest fit in maxSize."
+    entries = []
+    for name in os.listdir(cacheDir):
+      if name.endswith(".dirty") or name.endswith(".clean"):
+        path = os.path.join(cacheDir, name)
+        stat = os.stat(path)
+        entries.append((stat.st_mtime, stat.st_size, path))
+    entries.sort()
+    total = sum(size for (mtime, size, path) in entries)
+    for (mtime, size, path) in entries:
+      if total <= self.maxSize:
+        break
+      os.remove(path)
+      total -= size
@@ -15,7 +15,651 @@
 __revision__ = "$Id: ballots.py 821 2010-11-19 23:36:17Z jeff.oneill $"
 
 import os
-from openstv.plugins import getLoaderPlugins, getLoaderPluginClass
+import glob
+import tempfile
+import multiprocessing
+from bisect import insort
+from array import array
+from itertools import izip, imap
+from openstv.plugins import getLoaderPlugins, getLoaderPluginClass, \
+     splitCompression, getCompression, readFileHead
+
+##################################################################
+
+class BallotIndex(object):
+  """Ballot indices of each unique ballot in compressed sparse row form.
+  
+  index[u] is an array of the indices into the ballot order of the ballots
+  that are copies of unique ballot u, in increasing order.
+  """
+
+  def __init__(self, ballotOrder, uniqueBallotCount):
+
+    # offsets[u] is where the ballot indices of unique ballot u start
+    self.offsets = array("l", [0])
+    total = 0
+    for weight in uniqueBallotCount:
+      total += weight
+      self.offsets.append(total)
+
+    # Counting sort of the ballot indices by unique ballot
+    self.indices = array("l", [0]) * len(ballotOrder)
+    nextPosition = self.offsets[:-1]
+    indices = self.indices
+    for i, u in enumerate(ballotOrder):
+      indices[nextPosition[u]] = i
+      nextPosition[u] += 1
+
+  def __len__(self):
+    return len(self.offsets) - 1
+
+  def __getitem__(self, u):
+    return self.indices[self.offsets[u]:self.offsets[u+1]]
+
+##################################################################
+
+class CandidateIndex(object):
+  """Unique ballots that rank each candidate.
+  
+  This is an inverted index of the ballots.  ranking(c) is an array of the
+  unique ballots that rank candidate c, in increasing order, and
+  rankingAt(c, r) gives those that rank candidate c at rank position r
+  (where 0 is the first ranking).  If a ballot ranks a candidate more than
+  once, only the first ranking is kept.
+  """
+
+  def __init__(self, ballotViews, numCandidates, hasEqualRankings):
+    self.numWeightedBallots = len(ballotViews)
+    self.ballots = [array("l") for c in range(numCandidates)]
+    self.ranks = [array("i") for c in range(numCandidates)]
+
+    ballots = self.ballots
+    ranks = self.ranks
+    for u, ballot in enumerate(ballotViews):
+      if (not hasEqualRankings and -1 not in ballot and
+          len(set(ballot)) == len(ballot)):
+        # The usual case of a clean ballot
+        for r, c in enumerate(ballot):
+          ballots[c].append(u)
+          ranks[c].append(r)
+        continue
+
+      seen = set()
+      for r, item in enumerate(ballot):
+        if hasEqualRankings and isinstance(item, list):
+          group = item
+        else:
+          group = (item,)
+        for c in group:
+          if c == -1 or c in seen:
+            continue
+          seen.add(c)
+          ballots[c].append(u)
+          ranks[c].append(r)
+
+  def ranking(self, c):
+    "Return the unique ballots that rank candidate c."
+    return self.ballots[c]
+
+  def rankingAt(self, c, r):
+    "Return the unique ballots that rank candidate c at rank position r."
+    return array("l", [u for u, r2 in izip(self.ballots[c], self.ranks[c])
+                       if r2 == r])
+
+  def notRanking(self, c):
+    "Return the unique ballots that do not rank candidate c."
+    notRanked = array("l")
+    start = 0
+    for u in self.ballots[c]:
+      # The gap before each ballot that ranks c
+      notRanked.extend(xrange(start, u))
+      start = u + 1
+    notRanked.extend(xrange(start, self.numWeightedBallots))
+    return notRanked
+
+##################################################################
+
+class BallotViews(object):
+  "Sequence of the unique ballots of a store, made one at a time."
+
+  def __init__(self, store):
+    self.store = store
+
+  def __len__(self):
+    return self.store.numWeightedBallots
+
+  def __getitem__(self, u):
+    return self.store.getBallotView(u)
+
+##################################################################
+
+class BallotStore(object):
+  "Base class for ballot stores."
+
+  def __init__(self):
+    self.ballotIndex = None
+    # A cached BallotIndex for the current ballots or None.  Any change to
+    # the ballot order must reset this to None.
+
+    self.candidateIndex = None
+    # A cached CandidateIndex for the current ballots or None.  Any change to
+    # the unique ballots must reset this to None.
+
+  @property
+  def numBallots(self):
+    return len(self.ballotOrder)
+
+  @property
+  def numWeightedBallots(self):
+    return len(self.uniqueBallotCount)
+
+  @property
+  def uniqueBallotIndexToBallotIndices(self):
+    """Map from each unique ballot to the indices of its ballots.
+    
+    This is rarely needed, so it is built only when asked for and kept until
+    the ballots change.
+    """
+    if self.ballotIndex is None:
+      self.ballotIndex = BallotIndex(self.ballotOrder, self.uniqueBallotCount)
+    return self.ballotIndex
+
+  def appendBallots(self, weightedBallots):
+    "Append (weight, ballot) pairs from an iterable, skipping zero weights."
+    for weight, ballot in weightedBallots:
+      if weight > 0:
+        self.appendBallot(ballot, weight)
+
+  def appendUniqueBallots(self, uniqueBallots, uniqueBallotCount,
+                          ballotOrder):
+    """Append the ballots of another table of unique ballots.
+    
+    uniqueBallots and uniqueBallotCount are the unique ballots and their
+    weights, and ballotOrder gives the order of the ballots as indices into
+    uniqueBallots.  This merges the tables one unique ballot at a time.
+    """
+    remap = []
+    for ballot, weight in zip(uniqueBallots, uniqueBallotCount):
+      u = self.appendBallot(ballot, 0)
+      self.uniqueBallotCount[u] += weight
+      remap.append(u)
+    self.ballotOrder.extend(map(remap.__getitem__, ballotOrder))
+    self.ballotIndex = None
+    self.candidateIndex = None
+
+  @classmethod
+  def fromStore(cls, store):
+    "Return a store of this kind holding the same ballots as another store."
+    newStore = cls()
+    for u in xrange(store.numWeightedBallots):
+      # The unique ballots are distinct so each one keeps its index
+      newStore.appendBallot(store.getBallot(u), 0)
+      newStore.uniqueBallotCount[u] += store.uniqueBallotCount[u]
+    newStore.setBallotOrder(list(store.ballotOrder))
+    return newStore
+
+  def getCandidateIndex(self, numCandidates):
+    "Return a CandidateIndex of the unique ballots, building it if needed."
+    if self.candidateIndex is None:
+      self.candidateIndex = CandidateIndex(self.getBallotViews(),
+                                           numCandidates,
+                                           self.hasEqualRankings)
+    return self.candidateIndex
+
+##################################################################
+
+class ListBallotStore(BallotStore):
+  """Default storage for the ballots in a Ballots object.
+  
+  Each unique ballot is kept as a Python tuple.  This is the fastest store
+  for small and medium sized elections and for editing ballots.
+  """
+
+  def __init__(self):
+    BallotStore.__init__(self)
+
+    self.uniqueBallots = []
+    # This is a list of unique ballots.  Each item of the list is a ballot,
+    # and each ballot is a tuple of candidate numbers that represent the
+    # candidates being ranked.  For example, if a ballot is (2 4 1), then
+    # candidate number 2 is ranked first, candidate number 4 is ranked second,
+    # and candidate number 1 is ranked third.  Equal rankings are stored as
+    # nested tuples so that every unique ballot is hashable.
+    
+    self.uniqueBallotCount = []
+    # This is the weight for each unique ballot.
+    
+    self.uniqueBallotsLookup = {}
+    # The keys to this dictionary are the unique ballots themselves (the
+    # same tuples that are in self.uniqueBallots so no second copy is kept)
+    # and the values are the indices into self.uniqueBallots.  This
+    # dictionary indicates whether a given ballot has already been seen, and
+    # if so, where the ballot exists in self.uniqueBallots.
+    
+    self.ballotOrder = []
+    # The length of this list is the total number of ballots.  Each entry is 
+    # the index into self.uniqueBallots of the corresponding ballot.
+
+    self.hasEqualRankings = False
+    # Whether any unique ballot contains a group of equal rankings.
+
+  def canonicalBallot(self, ballot):
+    "Return a ballot with equal rankings as a hashable tuple."
+    self.hasEqualRankings = True
+    return tuple([tuple(item) if isinstance(item, list) else item
+                  for item in ballot])
+
+  def appendBallot(self, ballot, weight=1):
+    """Append weight copies of a ballot and return the index of its unique
+    ballot."""
+
+    # The ballot as a tuple is its key for determining whether it is unique
+    key = tuple(ballot)
+    try:
+      uniqueBallotIndex = self.uniqueBallotsLookup.get(key)
+    except TypeError:
+      # Equal rankings are lists and must be made hashable
+      key = self.canonicalBallot(ballot)
+      uniqueBallotIndex = self.uniqueBallotsLookup.get(key)
+
+    if uniqueBallotIndex is not None:
+      # We have seen this ballot before 
+      self.uniqueBallotCount[uniqueBallotIndex] += weight
+    else:
+      # We have not seen this ballot before
+      self.uniqueBallots.append(key)
+      self.uniqueBallotCount.append(weight)
+      uniqueBallotIndex = len(self.uniqueBallots) - 1
+      self.uniqueBallotsLookup[key] = uniqueBallotIndex
+    if weight == 1:
+      self.ballotOrder.append(uniqueBallotIndex)
+    else:
+      self.ballotOrder.extend([uniqueBallotIndex] * weight)
+    self.ballotIndex = None
+    self.candidateIndex = None
+    return uniqueBallotIndex
+
+  def appendBallots(self, weightedBallots):
+    "Append (weight, ballot) pairs from an iterable, skipping zero weights."
+
+    # This is appendBallot() without a method call for each ballot
+    lookup = self.uniqueBallotsLookup
+    uniqueBallots = self.uniqueBallots
+    uniqueBallotCount = self.uniqueBallotCount
+    ballotOrder = self.ballotOrder
+    for weight, ballot in weightedBallots:
+      if weight <= 0:
+        continue
+      key = tuple(ballot)
+      try:
+        uniqueBallotIndex = lookup.get(key)
+      except TypeError:
+        key = self.canonicalBallot(ballot)
+        uniqueBallotIndex = lookup.get(key)
+      if uniqueBallotIndex is not None:
+        uniqueBallotCount[uniqueBallotIndex] += weight
+      else:
+        uniqueBallotIndex = len(uniqueBallots)
+        uniqueBallots.append(key)
+        uniqueBallotCount.append(weight)
+        lookup[key] = uniqueBallotIndex
+      if weight == 1:
+        ballotOrder.append(uniqueBallotIndex)
+      else:
+        ballotOrder.extend([uniqueBallotIndex] * weight)
+    self.ballotIndex = None
+    self.candidateIndex = None
+
+  def getBallot(self, u):
+    "Return a copy of the uth unique ballot."
+    if not self.hasEqualRankings:
+      return list(self.uniqueBallots[u])
+    return [list(item) if isinstance(item, tuple) else item
+            for item in self.uniqueBallots[u]]
+
+  def getBallotView(self, u):
+    "Return the uth unique ballot without copying it when possible."
+    if not self.hasEqualRankings:
+      return self.uniqueBallots[u]
+    return self.getBallot(u)
+
+  def getBallotViews(self):
+    "Return a sequence of views of all of the unique ballots."
+    if not self.hasEqualRankings:
+      return self.uniqueBallots
+    return [self.getBallot(u) for u in xrange(self.numWeightedBallots)]
+
+  def iterWeightedBallots(self):
+    "Iterate over (weight, ballot view) pairs of the unique ballots."
+    if not self.hasEqualRankings:
+      return izip(self.uniqueBallotCount, self.uniqueBallots)
+    return izip(self.uniqueBallotCount,
+                [self.getBallot(u) for u in xrange(self.numWeightedBallots)])
+
+  def getTopChoice(self, u, choices):
+    "Return the top choice on the uth unique ballot among choices."
+    for c in self.uniqueBallots[u]:
+      if c in choices:
+        return c
+    return None
+
+  def remapCandidates(self, c2c):
+    "Translate candidate numbers on every unique ballot using c2c."
+
+    # Translate all the candidate numbers. This must be done in two places:
+    # (1) The ballots in uniqueBallots
+    # (2) The keys in uniqueBallotsLookup
+    # Since c2c is a permutation, each translated ballot is still unique and
+    # keeps its index, so the new keys are the translated ballots themselves.
+    lookup = {}
+    for i, ballot in enumerate(self.uniqueBallots):
+      if self.hasEqualRankings:
+        ballot = tuple([tuple([c2c[c] for c in item])
+                        if isinstance(item, tuple) else c2c[item]
+                        for item in ballot])
+      else:
+        ballot = tuple([c2c[c] for c in ballot])
+      self.uniqueBallots[i] = ballot
+      lookup[ballot] = i
+    self.uniqueBallotsLookup = lookup
+    self.candidateIndex = None
+
+  def setBallotOrder(self, ballotOrder):
+    "Replace the ballot order with a list of unique ballot indices."
+    self.ballotOrder = ballotOrder
+    self.ballotIndex = None
+
+  @classmethod
+  def fromStore(cls, store):
+    "Return a store of this kind holding the same ballots as another store."
+    newStore = cls()
+    if store.hasEqualRankings:
+      newStore.uniqueBallots = [newStore.canonicalBallot(store.getBallot(u))
+                                for u in xrange(store.numWeightedBallots)]
+    else:
+      newStore.uniqueBallots = map(tuple, store.getBallotViews())
+    newStore.uniqueBallotCount = list(store.uniqueBallotCount)
+    newStore.uniqueBallotsLookup = dict(
+      izip(newStore.uniqueBallots, xrange(store.numWeightedBallots)))
+    newStore.ballotOrder = list(store.ballotOrder)
+    return newStore
+
+##################################################################
+
+class ArrayBallotStore(BallotStore):
+  """Compact storage for the ballots in a Ballots object.
+  
+  Python lists of Python ints take roughly ten times the memory of the
+  numbers they hold, which matters with millions of cast vote records.
+  This store keeps the rankings of all unique ballots in one flat integer
+  array and uses an offsets array to find where each unique ballot starts.
+  The weights and the ballot order are also kept in typed arrays.
+
+  Rankings are encoded as in a ballot list, except that a group of k
+  equally ranked candidates is stored as the marker -(k+1) followed by the
+  k candidate numbers.  A skipped ranking is still -1.
+  """
+
+  def __init__(self):
+    BallotStore.__init__(self)
+
+    self.rankings = array("i")
+    # The rankings of all of the unique ballots, one after another.
+
+    self.offsets = array("l", [0])
+    # The rankings of unique ballot u are rankings[offsets[u]:offsets[u+1]].
+
+    self.uniqueBallotCount = array("l")
+    # This is the weight for each unique ballot.
+
+    self.uniqueBallotsLookup = {}
+    # The keys to this dictionary are the packed bytes of the encoded
+    # rankings of each unique ballot and the values are the indices of the
+    # unique ballots.
+
+    self.ballotOrder = array("l")
+    # The index of the unique ballot for each ballot.
+
+    self.hasEqualRankings = False
+    # Whether any unique ballot contains a group of equal rankings.  Without
+    # groups, the flat rankings can be used directly.
+
+  @classmethod
+  def fromArrays(cls, rankings, offsets, uniqueBallotCount, ballotOrder,
+                 hasEqualRankings):
+    """Return a store that uses already encoded arrays.
+    
+    The arrays are used as they are, so this takes no time beyond reading
+    them.  The lookup of unique ballots is only built if more ballots are
+    appended.
+    """
+
+    store = cls()
+    store.rankings = rankings
+    store.offsets = offsets
+    store.uniqueBallotCount = uniqueBallotCount
+    store.ballotOrder = ballotOrder
+    store.hasEqualRankings = hasEqualRankings
+    store.uniqueBallotsLookup = None
+    return store
+
+  def buildLookup(self):
+    "Build the lookup of unique ballots from the rankings."
+    rankings = self.rankings
+    offsets = self.offsets
+    self.uniqueBallotsLookup = dict(
+      (rankings[offsets[u]:offsets[u+1]].tostring(), u)
+      for u in xrange(self.numWeightedBallots))
+
+  def encodeBallot(self, ballot):
+    "Convert a ballot to its flat encoding."
+    encoded = []
+    for item in ballot:
+      if isinstance(item, list):
+        self.hasEqualRankings = True
+        encoded.append(-len(item) - 1)
+        encoded.extend(item)
+      else:
+        encoded.append(item)
+    return encoded
+
+  def decodeRankings(self, rankings):
+    "Convert a flat encoding back to a ballot."
+    if not self.hasEqualRankings:
+      return rankings.tolist()
+    ballot = []
+    j = 0
+    while j < len(rankings):
+      item = rankings[j]
+      if item < -1:
+        n = -item - 1
+        ballot.append(rankings[j+1:j+1+n].tolist())
+        j += n + 1
+      else:
+        ballot.append(item)
+        j += 1
+    return ballot
+
+  def appendBallot(self, ballot, weight=1):
+    """Append weight copies of a ballot and return the index of its unique
+    ballot."""
+
+    # The packed bytes of the encoded ballot are its key
+    try:
+      encoded = array("i", ballot)
+    except TypeError:
+      # Equal rankings are lists and need a group marker
+      encoded = array("i", self.encodeBallot(ballot))
+    key = encoded.tostring()
+    if self.uniqueBallotsLookup is None:
+      self.buildLookup()
+    uniqueBallotIndex = self.uniqueBallotsLookup.get(key)
+
+    if uniqueBallotIndex is not None:
+      self.uniqueBallotCount[uniqueBallotIndex] += weight
+    else:
+      self.rankings.extend(encoded)
+      self.offsets.append(len(self.rankings))
+      self.uniqueBallotCount.append(weight)
+      uniqueBallotIndex = len(self.uniqueBallotCount) - 1
+      self.uniqueBallotsLookup[key] = uniqueBallotIndex
+    if weight == 1:
+      self.ballotOrder.append(uniqueBallotIndex)
+    else:
+      self.ballotOrder.extend(array("l", [uniqueBallotIndex]) * weight)
+    self.ballotIndex = None
+    self.candidateIndex = None
+    return uniqueBallotIndex
+
+  def getBallot(self, u):
+    "Return a copy of the uth unique ballot."
+    return self.decodeRankings(
+      self.rankings[self.offsets[u]:self.offsets[u+1]])
+
+  def getBallotView(self, u):
+    "Return the uth unique ballot without decoding it when possible."
+    if not self.hasEqualRankings:
+      return self.rankings[self.offsets[u]:self.offsets[u+1]]
+    return self.getBallot(u)
+
+  def getBallotViews(self):
+    "Return a sequence of views of all of the unique ballots."
+    return BallotViews(self)
+
+  def iterWeightedBallots(self):
+    "Iterate over (weight, ballot view) pairs of the unique ballots."
+    rankings = self.rankings
+    offsets = self.offsets
+    for u, weight in enumerate(self.uniqueBallotCount):
+      if self.hasEqualRankings:
+        yield (weight, self.getBallot(u))
+      else:
+        yield (weight, rankings[offsets[u]:offsets[u+1]])
+
+  def getTopChoice(self, u, choices):
+    "Return the top choice on the uth unique ballot among choices."
+    if self.hasEqualRankings:
+      ballot = self.getBallot(u)
+    else:
+      ballot = self.rankings[self.offsets[u]:self.offsets[u+1]]
+    for c in ballot:
+      if c in choices:
+        return c
+    return None
+
+  def remapCandidates(self, c2c):
+    "Translate candidate numbers on every unique ballot using c2c."
+
+    # The new keys of uniqueBallotsLookup are taken directly from the
+    # translated rankings as each unique ballot is translated.
+    lookup = {}
+    rankings = self.rankings
+    offsets = self.offsets
+    for u in xrange(self.numWeightedBallots):
+      j = offsets[u]
+      end = offsets[u+1]
+      while j < end:
+        item = rankings[j]
+        if item < -1:
+          # Group markers stay as they are
+          for k in xrange(j+1, j-item):
+            rankings[k] = c2c[rankings[k]]
+          j -= item
+        else:
+          rankings[j] = c2c[item]
+          j += 1
+      lookup[rankings[offsets[u]:end].tostring()] = u
+    self.uniqueBallotsLookup = lookup
+    self.candidateIndex = None
+
+  def setBallotOrder(self, ballotOrder):
+    "Replace the ballot order with a list of unique ballot indices."
+    self.ballotOrder = array("l", ballotOrder)
+    self.ballotIndex = None
+
+##################################################################
+
+class TransferCursor(object):
+  """Next preference cursor for transferring ballots during a count.
+  
+  Finding the top choice on a ballot means skipping over every candidate
+  that is no longer continuing.  During a count the set of continuing
+  candidates only shrinks, so a candidate skipped once never needs to be
+  looked at again.  The cursor remembers where the top choice of each
+  unique ballot was found and moves forward from there.
+  
+  The count must call newGeneration() whenever candidates are removed from
+  the continuing set.  Until then, the top choice found for a ballot is
+  returned without looking at the ballot again.
+  """
+
+  def __init__(self, ballots, continuing):
+    self.store = ballots.store
+    self.ballotOrder = self.store.ballotOrder
+    self.ballots = self.store.getBallotViews()
+
+    self.continuing = continuing
+    # The set of continuing candidates.  It must be the same set object
+    # that the count removes candidates from.
+
+    self.generation = 0
+    # The number of times the continuing candidates have changed.
+
+    n = self.store.numWeightedBallots
+    self.position = [0] * n
+    # position[u] is where the top choice of unique ballot u is ranked.
+    
+    self.checked = [-1] * n
+    # checked[u] is the generation when position[u] was last moved.
+
+    self.topChoice = [None] * n
+    # topChoice[u] is the top choice found at generation checked[u].
+
+  def newGeneration(self):
+    "Record that candidates are no longer continuing."
+    self.generation += 1
+
+  def getTopChoiceFromBallot(self, i, choices=None):
+    "Return the top choice on the ith ballot."
+    return self.getTopChoiceFromWeightedBallot(self.ballotOrder[i], choices)
+
+  def getTopChoiceFromWeightedBallot(self, u, choices=None):
+    """Return the top choice on the uth unique ballot.
+    
+    Without choices, this is the top choice among the continuing candidates.
+    Otherwise, choices must be a subset of the continuing candidates, and the
+    top choice among them is found without moving the cursor.
+    """
+
+    if self.checked[u] != self.generation:
+      # Move the cursor forward to the top choice
+      self.checked[u] = self.generation
+      if self.store.hasEqualRankings:
+        # Equal rankings are skipped as in getTopChoice() of the store
+        c = self.store.getTopChoice(u, self.continuing)
+      else:
+        j = self.position[u]
+        ballot = self.ballots[u][j:] if j else self.ballots[u]
+        continuing = self.continuing
+        for c in ballot:
+          if c in continuing:
+            self.position[u] = j + ballot.index(c)
+            break
+        else:
+          c = None
+          self.position[u] = j + len(ballot)
+      self.topChoice[u] = c
+    else:
+      c = self.topChoice[u]
+
+    if choices is None or c is None or c in choices:
+      return c
+    if self.store.hasEqualRankings:
+      return self.store.getTopChoice(u, choices)
+    for c in self.ballots[u][self.position[u]+1:]:
+      if c in choices:
+        return c
+    return None
 
 ##################################################################
 
@@ -40,7 +684,7 @@ class Ballots(object):
   error should be raised immediately.
   """
 
-  def __init__(self, customBallotIDs=False):
+  def __init__(self, customBallotIDs=False, compact=False):
 
     self.title = "Title" # An election title.
     self.date = ""       # The date of the election.
@@ -50,6 +694,7 @@ class Ballots(object):
     self.exceptionQueue = None # Used to erport exceptions back to GUI
     self.dirtyBallots = None # For clean ballots this is a pointer to the 
                              # dirty ballots from which they were created
+    self.compact = compact # Whether to use the compact ballot store
 
     self._names = []
     self._n2i = {}
@@ -71,32 +716,11 @@ class Ballots(object):
     # ballot will be given a ballotID.
 
     # In any ballot list, many of the ballots will be identical so, instead
-    # of storing each ballot, only unique ballots will be stored.
+    # of storing each ballot, only unique ballots will be stored.  The unique
+    # ballots, their weights, and the order of the ballots are kept in a
+    # ballot store (see ListBallotStore and ArrayBallotStore).
 
-    self.uniqueBallots = []
-    # This is a list of unique ballots.  Each item of the list is a ballot,
-    # and each ballot is a list of candidate numbers that represent the
-    # candidates being ranked.  For example, if a ballot is [2 4 1], then
-    # candidate number 2 is ranked first, candidate number 4 is ranked second,
-    # and candidate number 1 is ranked third.
-    
-    self.uniqueBallotCount = []
-    # This is the weight for each unique ballot.
-    
-    self.uniqueBallotIndexToBallotIndices = []
-    # This list has the same length as self.uniqueBallots.  Each item of the
-    # list is a Python set that contains the indices of self.ballotOrder
-    # corresponding to the unique ballot.
-    
-    self.uniqueBallotsLookup = {}
-    # The keys to this dictionary are string representations of unique
-    # ballots and the values are the indices into self.uniqueBallots.  This
-    # dictionary indicates whether a given ballot has already been seen, and
-    # if so, where the ballot exists in self.uniqueBallots.
-    
-    self.ballotOrder = []
-    # The length of this list is the total number of ballots.  Each entry is 
-    # the index into self.uniqueBallots of the corresponding ballot.
+    self.store = self.newStore()
 
     self.ballotIDsList = []
     # A list of the ballot IDs in the order specified in the ballot file.
@@ -104,11 +728,42 @@ class Ballots(object):
     # the ballotID is computed from the ballot index (1 .. N).
 
     self.loader = None
+
+    self.cacheKey = None
+    # The digest of the file the ballots were loaded from when they were
+    # loaded with a BallotCache, or None.
+
+  def newStore(self):
+    "Return an empty ballot store of the kind used by this object."
+    if self.compact:
+      return ArrayBallotStore()
+    else:
+      return ListBallotStore()
+
+  def setStore(self, store, ballotIDs=None):
+    """Replace all of the ballots with the ballots in a store.
+    
+    A compact store is kept as it is, since its arrays are usually read
+    straight from a file, and the ballots are compact from then on.  Other
+    stores are converted if this object uses compact stores.  If custom
+    ballot IDs are used, ballotIDs gives the ID of each ballot.
+    """
+
+    assert((ballotIDs == None) ^ (self.customBallotIDs)) # XOR
+
+    if isinstance(store, ArrayBallotStore):
+      self.compact = True
+    elif self.compact:
+      store = ArrayBallotStore.fromStore(store)
+    self.store = store
+    self.ballotIDsList = list(ballotIDs) if ballotIDs is not None else []
+    if ballotIDs is not None:
+      assert(len(self.ballotIDsList) == self.numBallots)
     
   def copy(self, copyBallots=True):
 
     # Documentation for copy module says it doesn't work with arrays
-    ballotList = Ballots()
+    ballotList = Ballots(compact=self.compact)
     ballotList.customBallotIDs = self.customBallotIDs
     ballotList.title = self.title
     ballotList.date = self.date
@@ -127,11 +782,11 @@ class Ballots(object):
   
   @property
   def numBallots(self):
-    return len(self.ballotOrder)
+    return self.store.numBallots
 
   @property
   def numWeightedBallots(self):
-    return len(self.uniqueBallots)
+    return self.store.numWeightedBallots
 
   def getNumCandidates(self):
     return len(self.names)
@@ -175,27 +830,55 @@ class Ballots(object):
     # ballot loader do the checking.
     #self.checkBallot(ballot)
     
-    # String representation of ballot for determining whether it is unique
-    ballotString = str(ballot)
-
     # Record the ballot ID if there is one
     if ballotID is not None:
       self.ballotIDsList.append(ballotID)
 
-    ballotIndex = len(self.ballotOrder) # Index of the ballot being added
-    if ballotString in self.uniqueBallotsLookup:
-      # We have seen this ballot before 
-      uniqueBallotIndex = self.uniqueBallotsLookup[ballotString]
-      self.uniqueBallotIndexToBallotIndices[uniqueBallotIndex].add(ballotIndex)
-      self.uniqueBallotCount[uniqueBallotIndex] += 1
-    else:
-      # We have not seen this ballot before
-      self.uniqueBallots.append(ballot)
-      self.uniqueBallotCount.append(1)
-      uniqueBallotIndex = len(self.uniqueBallots) - 1
-      self.uniqueBallotsLookup[ballotString] = uniqueBallotIndex
-      self.uniqueBallotIndexToBallotIndices.append(set([ballotIndex]))
-    self.ballotOrder.append(uniqueBallotIndex)
+    self.store.appendBallot(ballot)
+
+  def appendWeightedBallot(self, ballot, weight):
+    """Append weight copies of a ballot to this Ballots object.
+    
+    This does the work of appending one ballot instead of one per copy, so
+    packed ballot files load in time proportional to their number of lines.
+    Custom ballot IDs are not possible since the copies have no IDs.
+    """
+
+    assert(not self.customBallotIDs)
+    if weight > 0:
+      self.store.appendBallot(ballot, weight)
+
+  def appendBallots(self, weightedBallots, ballotIDs=None):
+    """Append (weight, ballot) pairs from an iterable.
+    
+    If custom ballot IDs are used, ballotIDs gives the IDs of all of the
+    individual ballots appended, in order.
+    """
+
+    assert((ballotIDs == None) ^ (self.customBallotIDs)) # XOR
+
+    self.store.appendBallots(weightedBallots)
+
+    if ballotIDs is not None:
+      self.ballotIDsList.extend(ballotIDs)
+      assert(len(self.ballotIDsList) == self.numBallots)
+
+  def appendUniqueBallots(self, uniqueBallots, uniqueBallotCount,
+                          ballotOrder, ballotIDs=None):
+    """Append ballots given as a table of unique ballots.
+    
+    See BallotStore.appendUniqueBallots().  If custom ballot IDs are used,
+    ballotIDs gives the IDs of the ballots in ballotOrder.
+    """
+
+    assert((ballotIDs == None) ^ (self.customBallotIDs)) # XOR
+
+    self.store.appendUniqueBallots(uniqueBallots, uniqueBallotCount,
+                                   ballotOrder)
+
+    if ballotIDs is not None:
+      self.ballotIDsList.extend(ballotIDs)
+      assert(len(self.ballotIDsList) == self.numBallots)
 
   def appendBallotUsingNames(self, ballot, ballotID=None):
     "Append a ballot to this Ballots object."
@@ -204,30 +887,63 @@ class Ballots(object):
       ballot2.append(self._n2i[name])
     self.appendBallot(ballot2, ballotID)
 
+  def appendWeightedBallotUsingNames(self, ballot, weight):
+    "Append weight copies of a ballot to this Ballots object."
+    ballot2 = []
+    for name in ballot:
+      ballot2.append(self._n2i[name])
+    self.appendWeightedBallot(ballot2, weight)
+
   def getWeight(self, i):
     "Return the weight of the ith weighted ballot."
-    return self.uniqueBallotCount[i]
+    return self.store.uniqueBallotCount[i]
 
   def getWeightedBallot(self, i):
     "Return the ith weighted ballot."
 
-    return (self.uniqueBallotCount[i], self.uniqueBallots[i][:])
+    return (self.store.uniqueBallotCount[i], self.store.getBallot(i))
     
+  def getWeightedBallotView(self, i):
+    """Return the ith weighted ballot without copying the ballot.
+    
+    The ballot is read-only and must not be changed by the caller.  It is a
+    tuple or array of candidate numbers, and is only a list when the ballots
+    contain equal rankings.
+    """
+
+    return (self.store.uniqueBallotCount[i], self.store.getBallotView(i))
+
+  def getWeightedBallots(self):
+    """Iterate over the weighted ballots as (weight, ballot) pairs.
+
+    The ballots are read-only views as for getWeightedBallotView().  This is
+    the fastest way for a method to go through all of the weighted ballots.
+    """
+
+    return self.store.iterWeightedBallots()
+
+  def getCandidateIndex(self):
+    """Return a CandidateIndex giving the weighted ballots that rank each
+    candidate.  It is built the first time it is needed and kept until the
+    ballots change."""
+
+    return self.store.getCandidateIndex(self.numCandidates)
+
   def getSortedWeightedBallots(self):
     "This is used to compare two ballot lists for testing purposes."
 
     # We should replace this with a diff-like function that returns true
     # or false to indicate whether two ballots objects are the same.
     
-    sortedBallots = [(str(self.uniqueBallots[i]),
-                      self.uniqueBallotCount[i])
+    sortedBallots = [(str(self.store.getBallot(i)),
+                      self.store.uniqueBallotCount[i])
                      for i in xrange(self.numWeightedBallots)]
     sortedBallots.sort()
     return sortedBallots
 
   def getBallot(self, i):
-    j = self.ballotOrder[i]
-    return self.uniqueBallots[j][:]
+    j = self.store.ballotOrder[i]
+    return self.store.getBallot(j)
 
   def getBallotID(self, i):
     if self.customBallotIDs:
@@ -244,7 +960,8 @@ class Ballots(object):
     else:
       ballotIDs = range(1, self.numBallots + 1)
       
-    return zip([self.uniqueBallots[i][:] for i in self.ballotOrder], ballotIDs)
+    return zip([self.store.getBallot(i) for i in self.store.ballotOrder],
+               ballotIDs)
 
   def setBallot(self, i, ballot):
 
@@ -271,30 +988,19 @@ class Ballots(object):
       self.appendBallot(ballot, ballotID)
     
   def deleteBallots(self):
-    self.uniqueBallots = []
-    self.uniqueBallotIndexToBallotIndices = []
-    self.uniqueBallotsLookup = {}
+    self.store = self.newStore()
     self.ballotIDsList = []
-    self.ballotOrder = []
 
   def getTopChoiceFromBallot(self, i, choices):
     "Return the top choice on a ballot among candidates still in the running."
 
-    j = self.ballotOrder[i]
-    ballot = self.uniqueBallots[j]
-    for c in ballot:
-      if c in choices:
-        return c
-    return None
+    j = self.store.ballotOrder[i]
+    return self.store.getTopChoice(j, choices)
 
   def getTopChoiceFromWeightedBallot(self, i, choices):
     "Return the top choice on a ballot among candidates still in the running."
 
-    ballot = self.uniqueBallots[i]
-    for c in ballot:
-      if c in choices:
-        return c
-    return None
+    return self.store.getTopChoice(i, choices)
 
   def getCleanBallots(self, removeEmpty=True, removeOvervotes="Cambridge",
                       removeDupes=True, removeWithdrawn=True):
@@ -330,20 +1036,30 @@ class Ballots(object):
     # withdrawn candidates.  c2 = c2c[c] translates an original candidate
     # number "c" to a translated candidate number "c2" taking into account
     # candidates that have been removed from the ballots.  If a candidate is
-    # withdrawn, c2c returns None.  
+    # withdrawn, c2c returns None.  Withdrawn candidates are always dropped
+    # from the ballots, so a candidate that is dropped maps to None even if
+    # the numbers are not being shifted.
+    withdrawn = set(self.withdrawn)
     c2c = range(self.numCandidates)
-    if removeWithdrawn:
-      n = 0
-      for i in range(self.numCandidates):
-        if i in self.withdrawn:
-          c2c[i] = None
+    n = 0
+    for i in range(self.numCandidates):
+      if i in withdrawn:
+        c2c[i] = None
+        if removeWithdrawn:
           n += 1
-        else:
-          c2c[i] -= n
-
-    # Loop over ballots and perform requested cleaning
-    for i in xrange(self.numBallots):
-      ballot, ballotID = self.getBallotAndID(i)
+      else:
+        c2c[i] -= n
+
+    # Clean each unique ballot once.  uniqueMap[u] is the index of the clean
+    # version of unique ballot u, or -1 if the ballot is removed.  Unique
+    # ballots are numbered in the order they first appear, so the clean
+    # unique ballots are numbered in the same order as if each ballot were
+    # cleaned and appended in turn.
+    store = self.store
+    cleanStore = cleanBallots.store
+    uniqueMap = []
+    for u in xrange(self.numWeightedBallots):
+      ballot = store.getBallot(u)
       seenCandidates = set()
       cleanBallot = [] # This will be a cleaned version of ballot
       for item in ballot:
@@ -364,8 +1080,7 @@ class Ballots(object):
             if c == -1:
               continue  # Skipped ranking
             c2 = c2c[c] # Candidate number after removing withdrawn candidates
-            if not ((c in self.withdrawn) or (removeDupes and c2 in seenCandidates)):
-              assert(c2 is not None)
+            if not (c2 is None or (removeDupes and c2 in seenCandidates)):
               cleanItem.append(c2)
               seenCandidates.add(c2)
           if len(cleanItem) > 1:
@@ -378,17 +1093,36 @@ class Ballots(object):
           if c == -1:
             continue  # Skipped ranking
           c2 = c2c[c] # Candidate number after removing withdrawn candidates
-          if not ((c in self.withdrawn) or (removeDupes and c2 in seenCandidates)):
-            assert(c2 is not None)
+          if not (c2 is None or (removeDupes and c2 in seenCandidates)):
             cleanBallot.append(c2)
             seenCandidates.add(c2)
 
       if not removeEmpty or len(cleanBallot) > 0:
-        cleanBallots.appendBallot(cleanBallot, ballotID)
+        v = cleanStore.appendBallot(cleanBallot, 0)
+        cleanStore.uniqueBallotCount[v] += store.uniqueBallotCount[u]
+        uniqueMap.append(v)
+      else:
+        uniqueMap.append(-1)
+
+    # Translate the ballot order in one pass and keep the IDs of the
+    # ballots that remain.
+    if self.customBallotIDs:
+      ballotIDs = self.ballotIDsList
+    else:
+      ballotIDs = xrange(1, self.numBallots + 1)
+    ballotOrder = map(uniqueMap.__getitem__, store.ballotOrder)
+    if -1 in uniqueMap:
+      kept = [(v, ballotID) for v, ballotID in zip(ballotOrder, ballotIDs)
+              if v != -1]
+      ballotOrder = [v for v, ballotID in kept]
+      cleanBallots.ballotIDsList = [ballotID for v, ballotID in kept]
+    else:
+      cleanBallots.ballotIDsList = list(ballotIDs)
+    cleanStore.setBallotOrder(ballotOrder)
 
     # Remove the withdrawn candidates names
     cleanBallots.names = [self.names[c] for c in range(self.numCandidates)
-                          if c not in self.withdrawn]
+                          if c not in withdrawn]
     
     return cleanBallots
 
@@ -397,7 +1131,42 @@ class Ballots(object):
 
     ballotList = Ballots()
     ballotList.loadUnknown(fName)
+    self.appendBallotList(ballotList)
+
+  def appendFiles(self, fNames, key=None, processes=None, exclude0=True):
+    """Append ballot data from several files, such as precinct files.
     
+    See loadBallotFiles() for the arguments.  Each file must have the same
+    numbers of seats and candidates, names, and withdrawn candidates as
+    this Ballots object.
+    """
+
+    for ballotList in loadBallotFiles(fNames, key, processes, exclude0):
+      self.appendBallotList(ballotList)
+
+  def loadFiles(self, fNames, key=None, processes=None, exclude0=True):
+    """Load ballot data from several files, such as precinct files.
+    
+    See loadBallotFiles() for the arguments.  The seats, candidates, and
+    title are taken from the first file and the other files must match.
+    """
+
+    ballotLists = loadBallotFiles(fNames, key, processes, exclude0)
+    first = ballotLists.next()
+    self.customBallotIDs = first.customBallotIDs
+    self.title = first.title
+    self.date = first.date
+    self.numSeats = first.numSeats
+    self.names = first.names
+    self.withdrawn = first.withdrawn[:]
+    self.appendBallotList(first)
+    for ballotList in ballotLists:
+      self.appendBallotList(ballotList)
+    # Several files can't be saved back to one
+    self.loader = None
+
+  def checkAppend(self, ballotList):
+    "Raise an error if another Ballots object can't be appended to this one."
     if (ballotList.numSeats != self.numSeats or
         ballotList.names != self.names or
         ballotList.withdrawn != self.withdrawn):
@@ -406,19 +1175,35 @@ class Ballots(object):
             "the names of the candidates, and the withdrawn candidates \n"\
             "must be identical."
 
-    for i in xrange(ballotList.numBallots):
-      ballot = ballotList.getBallot(i)
-      ballotID = ballotList.getBallotID(i) if self.customBallotIDs else None
-      self.appendBallot(ballot, ballotID)
+  def appendBallotList(self, ballotList):
+    """Append the ballots of another Ballots object.
+    
+    The ballots are merged one unique ballot at a time.
+    """
+
+    self.checkAppend(ballotList)
+
+    ballotIDs = None
+    if self.customBallotIDs:
+      ballotIDs = [ballotList.getBallotID(i)
+                   for i in xrange(ballotList.numBallots)]
+    store = ballotList.store
+    uniqueBallots = [store.getBallot(u)
+                     for u in xrange(store.numWeightedBallots)]
+    self.appendUniqueBallots(uniqueBallots, store.uniqueBallotCount,
+                             store.ballotOrder, ballotIDs)
 
   def save(self):
     "Save back to the last file I was saved or loaded from"
     self.loader.save(self)
 
   def saveAs(self, fName, packed=False):
-    "Create a new ballot loader and save ballots"
+    """Create a new ballot loader and save ballots
     
-    extension = os.path.splitext(fName)[1][1:]
+    The file is compressed if its name ends with .gz, .bz2, or .xz.
+    """
+    
+    extension = os.path.splitext(splitCompression(fName)[0])[1][1:]
     loaderClass = getLoaderPluginClass(extension)
     if loaderClass is None:
       # If we don't know then the default is blt format
@@ -427,10 +1212,21 @@ class Ballots(object):
     self.loader.save(self, fName, packed)
 
   def loadKnown(self, fName, extension=None, exclude0 = True):
-    "Load a file based on its file extension."
+    """Load a file based on its file extension.
+    
+    A file name of - reads standard input, as BLT unless extension is given.
+    The extension of a compressed file is the one before its .gz, .bz2, or
+    .xz suffix.  A compressed file without one, such as ballots.gz, is
+    loaded with loadUnknown().
+    """
     
+    if extension is None and fName == "-":
+      extension = "blt"
     if extension is None:
-      extension = os.path.splitext(fName)[1][1:]
+      extension = os.path.splitext(splitCompression(fName)[0])[1][1:]
+      if extension == "" and getCompression(fName) is not None:
+        self.loadUnknown(fName, exclude0)
+        return
     loaderClass = getLoaderPluginClass(extension, exclude0)
     if loaderClass is None:
       raise RuntimeError, "Do not know how to load files with extension %s." % (extension)
@@ -439,11 +1235,26 @@ class Ballots(object):
     self.loader.load(self, fName)
 
   def loadUnknown(self, fName, exclude0 = True):
-    "Load a file of unknown format."
+    """Load a file of unknown format.
     
-    # Try the loader that claims this extension first.  If that one doesn't 
-    # work then we try the others.  Get the loader classes in the right order.
-    extension = os.path.splitext(fName)[1][1:]
+    Each loader checks the first bytes of the file, and the loaders that
+    accept it parse the whole file in order of confidence until one
+    succeeds.  Standard input (-) can't be read twice, so its format must be
+    given to loadKnown() instead.
+    """
+    
+    if fName == "-":
+      errorMsg = "Can't detect the format of ballots read from standard " \
+          "input.\nStandard input must be loaded with a known format."
+      if self.exceptionQueue is None:
+        raise RuntimeError(errorMsg)
+      self.exceptionQueue.put(errorMsg)
+      return
+
+    # The loader that claims this extension is tried first if it accepts the
+    # file, and then the others from the most confident.  Get the loader
+    # classes in the right order.
+    extension = os.path.splitext(splitCompression(fName)[0])[1][1:]
     loaderClasses = getLoaderPlugins("classes", exclude0)
     bestGuess = getLoaderPluginClass(extension, exclude0)
     if bestGuess is not None:
@@ -451,17 +1262,50 @@ class Ballots(object):
       loaderClasses.insert(0, bestGuess)
 
     errorMsg = "Could not load ballots from file %s." % fName
-      
-    # Try them in order
-    for loaderClass in loaderClasses:
+
+    head = readFileHead(fName)
+    if head.strip() == "":
+      errorMsg += "\nThere is no ballot data."
+      loaderClasses = []
+    accepted = []
+    for i, loaderClass in enumerate(loaderClasses):
+      loader = loaderClass()
       try:
-        self.loader = loaderClass()
+        confidence = loader.sniff(head)
+      except RuntimeError, (msg,):
+        errorMsg += "\n" + msg.strip()
+        continue
+      except Exception, err:
+        # A parser error, such as from the csv module, rejects the file too
+        errorMsg += "\nError when loading %s format ballots.  %s" \
+            % (loader.formatName, str(err).strip())
+        continue
+      accepted.append((loaderClass is not bestGuess, -confidence, i, loader))
+    accepted.sort()
+
+    # A loader that fails may have loaded part of the file, so each one
+    # starts from the same empty ballots.
+    state = (self.title, self.date, self.numSeats, self.customBallotIDs,
+             self.names, self.withdrawn[:])
+    loaded = False
+    for (notBestGuess, confidence, i, loader) in accepted:
+      try:
+        self.loader = loader
         self.loader.load(self, fName)
       except RuntimeError, (msg,):
         errorMsg += "\n" + msg.strip()
+        (self.title, self.date, self.numSeats, self.customBallotIDs,
+         names, withdrawn) = state
+        self._n2i = {}
+        self.names = names
+        self.withdrawn = withdrawn[:]
+        self.deleteBallots()
+        self.loader = None
       else:
+        loaded = True
         break
-    else:
+
+    if not loaded:
       # None of the ballot loaders succeeded so raise an exception
       if self.exceptionQueue is None:
         raise RuntimeError(errorMsg)
@@ -497,19 +1341,8 @@ class Ballots(object):
     for i, c in enumerate(order):
       c2c[c] = i
 
-    # Translate all the candidate numbers. This must be done in two places:
-    # (1) The ballots in uniqueBallots
-    # (2) The keys in uniqueBallotsLookup
-
-    # Easier to create a new uniqueBallotsLookup
-    self.uniqueBallotsLookup = {}
-
-    # Loop over all the weighted ballots
-    for i in xrange(self.numWeightedBallots):
-      for j, c in enumerate(self.uniqueBallots[i]):
-        self.uniqueBallots[i][j] = c2c[c]
-      ballotString = str(list(self.uniqueBallots[i]))
-      self.uniqueBallotsLookup[ballotString] = i
+    # Translate all the candidate numbers on the ballots
+    self.store.remapCandidates(c2c)
       
     # Put the names in the right order
     oldNames = self.names[:]
@@ -546,3 +1379,268 @@ class Ballots(object):
         return False
     return True
   
+##################################################################
+
+class IndexedBallots(Ballots):
+  """Ballots read lazily from a BLT file, for editing very large files.
+  
+  Loading a file with loadIndexed() scans it once to build an index of where
+  its ballots are (see BltBallotIndex), and a ballot is read from the file
+  only when it is asked for.  Changes are kept in memory until the ballots
+  are saved:
+
+    edited: the changed ballots and their IDs, keyed by their index in the
+    file.
+
+    deleted: the sorted indices in the file of the deleted ballots.
+
+    appended: the ballots and IDs appended after the ballots in the file.
+
+  Only the methods for working with individual ballots are supported.  Use
+  copy() or getCleanBallots() to get a Ballots object with all of the
+  ballots in memory.
+  """
+
+  def __init__(self, customBallotIDs=False, compact=False):
+    Ballots.__init__(self, customBallotIDs, compact)
+    self.store = None
+    self.index = None
+    self.edited = {}
+    self.deleted = []
+    self.appended = []
+
+  @staticmethod
+  def canIndex(fName):
+    "Return whether a file can be loaded with loadIndexed()."
+    if fName == "-" or getCompression(fName) is not None:
+      return False
+    extension = os.path.splitext(fName)[1][1:]
+    loaderClass = getLoaderPluginClass(extension, False)
+    return loaderClass is not None and hasattr(loaderClass, "loadIndex")
+
+  def loadIndexed(self, fName):
+    "Load a BLT file and index its ballots without reading them."
+
+    if not IndexedBallots.canIndex(fName):
+      raise RuntimeError, "Can't index the ballots in file %s." % fName
+
+    self._names = []
+    self._n2i = {}
+    self.withdrawn = []
+    loaderClass = getLoaderPluginClass(os.path.splitext(fName)[1][1:], False)
+    self.loader = loaderClass()
+    self.index = self.loader.loadIndex(self, fName)
+    self.edited = {}
+    self.deleted = []
+    self.appended = []
+
+  def closeIndex(self):
+    "Close the ballot file."
+    if self.index is not None:
+      self.index.close()
+
+  @property
+  def numFileBallots(self):
+    if self.index is None:
+      return 0
+    return self.index.numBallots - len(self.deleted)
+
+  @property
+  def numBallots(self):
+    return self.numFileBallots + len(self.appended)
+
+  def fileIndex(self, i):
+    "Return the index in the file of the ith ballot."
+    for j in self.deleted:
+      if j > i:
+        break
+      i += 1
+    return i
+
+  def getBallotAndID(self, i):
+    if i < 0:
+      i += self.numBallots
+    if not 0 <= i < self.numBallots:
+      raise IndexError, "Ballot index out of range."
+
+    if i >= self.numFileBallots:
+      (ballot, ballotID) = self.appended[i - self.numFileBallots]
+      ballot = ballot[:]
+    else:
+      j = self.fileIndex(i)
+      if j in self.edited:
+        (ballot, ballotID) = self.edited[j]
+        ballot = ballot[:]
+      else:
+        (ballot, ballotID) = self.index.getBallotAndID(j)
+    if not self.customBallotIDs:
+      ballotID = i + 1
+    return (ballot, ballotID)
+
+  def getBallot(self, i):
+    return self.getBallotAndID(i)[0]
+
+  def getBallotID(self, i):
+    return self.getBallotAndID(i)[1]
+
+  def getBallotsAndIDs(self):
+    return [self.getBallotAndID(i) for i in xrange(self.numBallots)]
+
+  def setBallot(self, i, ballot):
+
+    (oldBallot, ballotID) = self.getBallotAndID(i)
+    if ballot == oldBallot:
+      # The editor sets the ballot it shows whenever it moves to another
+      return
+    if not self.customBallotIDs:
+      ballotID = None
+    if i >= self.numFileBallots:
+      self.appended[i - self.numFileBallots] = (ballot[:], ballotID)
+    else:
+      self.edited[self.fileIndex(i)] = (ballot[:], ballotID)
+
+  def deleteBallot(self, i):
+
+    if i >= self.numFileBallots:
+      self.appended.pop(i - self.numFileBallots)
+    else:
+      j = self.fileIndex(i)
+      self.edited.pop(j, None)
+      insort(self.deleted, j)
+
+  def deleteBallots(self):
+    self.closeIndex()
+    self.index = None
+    self.edited = {}
+    self.deleted = []
+    self.appended = []
+
+  def appendBallot(self, ballot, ballotID=None):
+    "Append a ballot to this Ballots object."
+    assert((ballotID == None) ^ (self.customBallotIDs)) # XOR
+    self.appended.append((ballot[:], ballotID))
+
+  def appendBallotList(self, ballotList):
+    "Append the ballots of another Ballots object."
+
+    self.checkAppend(ballotList)
+    for i in xrange(ballotList.numBallots):
+      ballotID = ballotList.getBallotID(i) if self.customBallotIDs else None
+      self.appendBallot(ballotList.getBallot(i), ballotID)
+
+  def getCleanBallots(self, removeEmpty=True, removeOvervotes="Cambridge",
+                      removeDupes=True, removeWithdrawn=True):
+    "Return clean ballots with all of the ballots in memory."
+    cleanBallots = self.copy().getCleanBallots(removeEmpty, removeOvervotes,
+                                               removeDupes, removeWithdrawn)
+    cleanBallots.dirtyBallots = self
+    return cleanBallots
+
+  def save(self):
+    "Save back to the last file I was saved or loaded from"
+    self.saveAs(self.getFileName())
+
+  def saveAs(self, fName, packed=False):
+    """Save the ballots with the changes.
+    
+    A BLT file is written from the indexed file and the changes, and is then
+    indexed in place of it.  Other formats are saved from a copy of the
+    ballots in memory.
+    """
+
+    extension = os.path.splitext(splitCompression(fName)[0])[1][1:]
+    loaderClass = getLoaderPluginClass(extension)
+    if (packed or loaderClass is None or
+        not hasattr(loaderClass, "loadIndex") or
+        splitCompression(fName)[1] is not None):
+      ballotList = self.copy()
+      ballotList.saveAs(fName, packed)
+      self.loader = ballotList.loader
+      return
+
+    loader = loaderClass()
+    fName = loader.normalizeFileName(fName)
+    # The file may be the one the ballots are read from, so write the
+    # ballots to a temporary file and replace the file once they are written
+    (fd, tempName) = tempfile.mkstemp(suffix="." + extension,
+                                      dir=os.path.dirname(
+                                        os.path.abspath(fName)))
+    os.close(fd)
+    try:
+      loader.save(self, tempName)
+      self.closeIndex()
+      if os.path.exists(fName):
+        os.remove(fName)
+      os.rename(tempName, fName)
+    except:
+      if os.path.exists(tempName):
+        os.remove(tempName)
+      raise
+    self.loadIndexed(fName)
+
+
+##################################################################
+
+def loadBallotFile(job):
+  """Load a ballot file of unknown format for loadBallotFiles().
+  
+  job is a pair of the file name and exclude0 for loadUnknown().  This may
+  run in a worker process, so an error is returned as a message instead of
+  being raised.
+  """
+
+  (fName, exclude0) = job
+  ballotList = Ballots()
+  try:
+    ballotList.loadUnknown(fName, exclude0)
+  except RuntimeError, (msg,):
+    return (msg, None)
+  except IOError, err:
+    return (str(err), None)
+  ballotList.loader = None
+  return (None, ballotList)
+
+def loadBallotFiles(fNames, key=None, processes=None, exclude0=True):
+  """Load ballot files concurrently and yield their Ballots objects.
+  
+  fNames is a list of file names or glob patterns, or a single pattern.
+  Patterns are expanded in sorted order.  The files are yielded in that
+  order, or sorted by key if given.  processes is the number of processes
+  used to load the files (None for one per CPU).  The formats of the files
+  are found by loadUnknown() with exclude0.  Every file must exist before
+  any is loaded.
+  """
+
+  if isinstance(fNames, basestring):
+    fNames = [fNames]
+  expanded = []
+  for pattern in fNames:
+    expanded.extend(sorted(glob.glob(pattern)) or [pattern])
+  fNames = expanded
+  if key is not None:
+    fNames.sort(key=key)
+  if len(fNames) == 0:
+    raise RuntimeError, "No ballot files to load."
+  for fName in fNames:
+    if fName != "-" and not os.path.isfile(fName):
+      raise RuntimeError, "Cannot find the ballot file %s." % fName
+  jobs = [(fName, exclude0) for fName in fNames]
+
+  if processes is None:
+    processes = multiprocessing.cpu_count()
+  processes = min(processes, len(fNames))
+  pool = None
+  if processes > 1:
+    pool = multiprocessing.Pool(processes)
+    results = pool.imap(loadBallotFile, jobs)
+  else:
+    results = imap(loadBallotFile, jobs)
+
+  try:
+    for (error, ballotList) in results:
+      if error is not None:
+        raise RuntimeError(error)
+      yield ballotList
+  finally:
+    if pool is not None:
+      pool.terminate()
@@ -18,6 +18,16 @@ import sys
 import os.path
 import textwrap
 import pkgutil
+import io
+import gzip
+import bz2
+try:
+  import lzma
+except ImportError:
+  try:
+    from backports import lzma
+  except ImportError:
+    lzma = None # xz files can't be read or written
 
 from openstv.utils import getHome
 
@@ -148,10 +158,27 @@ class LoaderPlugin(object):
   status = 0
   extensions = ["blt"]
   formatName = None
+  binary = False # Whether load() reads the file in binary mode
   
   def __init__(self):
     self.fName = ""
 
+  def sniff(self, head):
+    """Check whether a file could be in this format from its first bytes.
+    
+    Return a confidence where higher is more certain, or report a load
+    error if the file can't be in this format.  Loaders that can't tell
+    return 1.
+    """
+    return 1
+
+  def getCompleteLines(self, head):
+    "Return the lines of the first bytes of a file without a partial line."
+    lines = head.splitlines(True)
+    if lines and not lines[-1].endswith("\n"):
+      lines.pop()
+    return lines
+
   def reportLoadError(self, msg):
     msg = "Error when loading %s format ballots.  %s"\
         % (self.formatName, msg)
@@ -160,17 +187,38 @@ class LoaderPlugin(object):
   def normalizeFileName(self, fName):
     if fName == "": 
       raise RuntimeError, "No file name given for saving ballots."
-    ext = os.path.splitext(fName)[1]
+    # The extension goes before any compression suffix
+    name = splitCompression(fName)[0]
+    ext = os.path.splitext(name)[1]
     if ('' == ext):
-      fName += "." + self.extensions[0]
+      fName = name + "." + self.extensions[0] + fName[len(name):]
     return fName
 
+  def openFile(self, mode=None):
+    """Open the file to load, where a file name of - is standard input.
+    
+    Compressed files are decompressed as they are read.  The mode is "rb"
+    for binary loaders and "r" for others unless it is given.
+    """
+    if mode is None:
+      mode = "rb" if self.binary else "r"
+    if self.fName == "-":
+      return sys.stdin
+    return openCompressed(self.fName, mode, getCompression(self.fName))
+
+  def createFile(self, mode="w"):
+    "Create the file to save, compressed if its name has a suffix for it."
+    return openCompressed(self.fName, mode, splitCompression(self.fName)[1])
+
   def load(self, ballotList, fName):
     """Load a file from a filename"""
     self.fName = fName
-    f = open(self.fName, "r")
-    self.loadFromObject(ballotList, f)
-    f.close()
+    f = self.openFile()
+    try:
+      self.loadFromObject(ballotList, f)
+    finally:
+      if f is not sys.stdin:
+        f.close()
 
 ##################################################################
 
@@ -306,6 +354,59 @@ def getLoaderPlugins(format, exclude0 = True):
   import openstv.LoaderPlugins
   return getPlugins(openstv.LoaderPlugins, LoaderPlugin, format, exclude0)
 
+# Compressed ballot files are recognized by their suffix or by the magic
+# bytes at the start of the file.
+compressions = [("gzip", ".gz", "\x1f\x8b"),
+                ("bz2", ".bz2", "BZh"),
+                ("xz", ".xz", "\xfd7zXZ\x00")]
+
+def splitCompression(fName):
+  """Split a file name into the name without a compression suffix and the
+  compression, which is None if there is no suffix."""
+  for (compression, suffix, magic) in compressions:
+    if fName.lower().endswith(suffix):
+      return (fName[:-len(suffix)], compression)
+  return (fName, None)
+
+def getCompression(fName):
+  "Return the compression of a file from its suffix or magic bytes or None."
+  compression = splitCompression(fName)[1]
+  if compression is None and os.path.isfile(fName):
+    f = open(fName, "rb")
+    head = f.read(6)
+    f.close()
+    for (c, suffix, magic) in compressions:
+      if head.startswith(magic):
+        compression = c
+  return compression
+
+def readFileHead(fName, size=8192):
+  "Return the first bytes of a file, decompressed if it is compressed."
+  f = openCompressed(fName, "rb", getCompression(fName))
+  head = f.read(size)
+  f.close()
+  return head
+
+def openCompressed(fName, mode, compression):
+  "Open a file that is compressed or decompressed as a stream."
+  if compression is None:
+    return open(fName, mode)
+  binaryMode = mode[0] + "b"
+  if compression == "gzip":
+    f = gzip.GzipFile(fName, binaryMode)
+  elif compression == "bz2":
+    # Already buffered
+    return bz2.BZ2File(fName, binaryMode)
+  elif lzma is None:
+    raise RuntimeError, "Can't open %s.  xz files need the lzma module." % \
+          fName
+  else:
+    f = lzma.open(fName, binaryMode)
+  # GzipFile and LZMAFile read lines slowly without a buffer
+  if binaryMode == "rb":
+    f = io.BufferedReader(f)
+  return f
+
 def getLoaderPluginClass(extension, exclude0 = True):
   "Return the most appropriate loader for a given file extension."
   plugins = getLoaderPlugins("classes", exclude0)
@@ -9,6 +9,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 import getopt
 
 from openstv.ballots import Ballots
+from openstv.ballotcache import BallotCache
 from openstv.plugins import getMethodPlugins, getReportPlugins
 
 methods = getMethodPlugins("byName", exclude0=False)
@@ -23,26 +24,35 @@ usage = """
 Usage:
 
   runElection.py [-p prec] [-r report] [-t tiebreak] [-w weaktie] [-s seats] 
-                 [-P] [-x reps] method ballotfile
+                 [-c] [-f format] [-j procs] [-k] [-K cachedir] [-P]
+                 [-x reps] method ballotfile ...
 
   -p: override default precision (in digits)
   -r: report format: %s
   -t: strong tie-break method: random*, alpha, index
   -w: weak tie-break method: (method-default)*, strong, forward, backward 
   -s: number of seats (for text-format ballot files)
+  -c: store ballots compactly (for very large ballot files)
+  -f: file extension of the format of ballots read from - (default: blt)
+  -j: number of processes for loading several ballot files (default: CPUs)
+  -k: cache parsed and cleaned ballots in .openstv-cache by the ballot file
+  -K: cache parsed and cleaned ballots in this directory
   -P: profile and send output to profile.out
   -x: specify repeat count (for profiling)
     *default
 
   Runs an election for the given method and ballot file. Results are
-  printed to stdout. The following methods are available:
+  printed to stdout. Several ballot files or glob patterns, such as the
+  files of precincts, are loaded concurrently and merged in the order
+  given. A ballot file of - reads standard input. The following methods
+  are available:
 %s
 """ % (", ".join(reportNames),
        "\n".join(["    " + name for name in methodNames]))
 
 # Parse the command line.
 try:
-  (opts, args) = getopt.getopt(sys.argv[1:], "Pp:r:s:t:w:x:")
+  (opts, args) = getopt.getopt(sys.argv[1:], "ckPf:j:K:p:r:s:t:w:x:")
 except getopt.GetoptError, err:
   print str(err) # will print something like "option -a not recognized"
   print usage
@@ -55,6 +65,10 @@ strongTieBreakMethod = None
 weakTieBreakMethod = None
 numSeats = None
 prec = None
+compact = False
+processes = None
+stdinFormat = None
+cache = None
 for o, a in opts:
   if o == "-r":
     if a in reportNames:
@@ -67,6 +81,16 @@ for o, a in opts:
     prec = int(a)
   if o == "-s":
     numSeats = int(a)
+  if o == "-c":
+    compact = True
+  if o == "-f":
+    stdinFormat = a
+  if o == "-k":
+    cache = BallotCache()
+  if o == "-K":
+    cache = BallotCache(a)
+  if o == "-j":
+    processes = int(a)
   if o == "-t":
     if a in ["random", "alpha", "index"]:
       strongTieBreakMethod = a
@@ -89,16 +113,13 @@ for o, a in opts:
   if o == "-x":
     reps = int(a)
 
-if len(args) != 2:
-  if len(args) < 2:
-    print "Specify method and ballot file"
-  else:
-    print "Too many arguments"
+if len(args) < 2:
+  print "Specify method and ballot file"
   print usage
   sys.exit(1)
 
 name = args[0]
-bltFn = args[1]
+bltFns = args[1:]
 
 if name not in methodNames:
   print "Unrecognized method '%s'" % name
@@ -106,11 +127,21 @@ if name not in methodNames:
   sys.exit(1)
 
 try:
-  dirtyBallots = Ballots()
-  dirtyBallots.loadKnown(bltFn, exclude0=False)
+  dirtyBallots = Ballots(compact=compact)
+  if bltFns == ["-"]:
+    dirtyBallots.loadKnown("-", stdinFormat, exclude0=False)
+  elif len(bltFns) == 1 and os.path.exists(bltFns[0]) and cache is not None:
+    cache.loadBallots(dirtyBallots, bltFns[0], known=True, exclude0=False)
+  elif len(bltFns) == 1 and os.path.exists(bltFns[0]):
+    dirtyBallots.loadKnown(bltFns[0], exclude0=False)
+  else:
+    dirtyBallots.loadFiles(bltFns, processes=processes, exclude0=False)
   if numSeats:
     dirtyBallots.numSeats = numSeats
-  cleanBallots = dirtyBallots.getCleanBallots()
+  if cache is not None:
+    cleanBallots = cache.getCleanBallots(dirtyBallots)
+  else:
+    cleanBallots = dirtyBallots.getCleanBallots()
 except RuntimeError, msg:
   print msg
   sys.exit(1)